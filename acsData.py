@@ -1,6 +1,8 @@
+import os
 import unittest
 from enum import Enum
 import numpy as np
+from dotenv import load_dotenv
 from censusData import *
 
 class acs_api(Enum):
@@ -41,12 +43,16 @@ class acsVar():
         self.code = code
 
 class acs1Data(censusData):
-    def __init__(self, year='', variables=[], location='', census_key=''):
-        super().__init__(year=year, dataset='acs/acs1', variables=variables, location=location, census_key=census_key)
+    def __init__(self, year='', variables=[], location='', census_key='', **kwargs):
+        super().__init__(year=year, dataset='acs/acs1', variables=variables, geography=location, **kwargs)
+        if census_key:
+            self.params['key'] = census_key
 
 class acs5Data(censusData):
-    def __init__(self, year='', variables=[], location='', census_key=''):
-        super().__init__(year=year, dataset='acs/acs5', variables=variables, location=location, census_key=census_key)
+    def __init__(self, year='', variables=[], location='', census_key='', **kwargs):
+        super().__init__(year=year, dataset='acs/acs5', variables=variables, geography=location, **kwargs)
+        if census_key:
+            self.params['key'] = census_key
 
 
 class MyTestCase(unittest.TestCase):
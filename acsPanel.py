@@ -0,0 +1,257 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from acsData import acs_type, acs1Data, acs5Data, available_sets
+from censusCache import DEFAULT_CACHE_DIR
+from censusFrame import GEOGRAPHY_COLUMNS
+from geoidUtils import GEOID_COMPONENTS, LEVEL_ALIASES, build_geoid
+
+DEFAULT_PANEL_DIR = os.path.join(DEFAULT_CACHE_DIR, 'panels')
+MAX_WORKERS = 4
+ACS_CLASSES = {acs_type.ACS1: acs1Data, acs_type.ACS5: acs5Data}
+PANEL_SHAPES = ('long', 'wide')
+LABEL_COLUMNS = ('year', 'NAME', 'GEOID')
+# Client errors mean the vintage does not exist (e.g. ACS1 2020 had no standard release) or does not have
+# these variables or geography, so retrying cannot help; 429 is rate limiting and is retried
+RETRIED_CLIENT_STATUSES = (429,)
+
+
+class vintageUnavailable(Exception):
+    pass
+
+
+def is_unavailable_status(status):
+    return status is not None and 400 <= status < 500 and status not in RETRIED_CLIENT_STATUSES
+
+def get_geography_level(geography):
+    """Returns the summary level of a 'for' clause such as 'tract:*', or None if it has no GEOID."""
+    level = geography.split(':')[0].strip()
+    level = LEVEL_ALIASES.get(level, level)
+    return level if level in GEOID_COMPONENTS else None
+
+def read_vintage_files(paths):
+    """Reads per-vintage files one by one so dtype differences between vintages are upcast by concat."""
+    frames = [pd.read_parquet(path) for path in paths]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+class acsPanel():
+    """
+    Multi-vintage panel of one ACS variable set for one geography.
+
+    Each vintage is stored as its own parquet file under a directory keyed on
+    the panel's definition, so a refresh only fetches the vintages that are
+    not on disk yet. The panel is read back long (one row per year and
+    geography) or wide (one column per variable and year).
+    """
+
+    def __init__(self, acs=acs_type.ACS5, variables=None, geography='', higher_geography='',
+                 store_dir=DEFAULT_PANEL_DIR, typed=True, with_moe=False):
+        """
+        :param acs: (acs_type) ACS1 or ACS5
+        :param variables: (list) Variables fetched for every vintage, e.g. ['B01001_001E']
+        :param geography: (str) 'for' clause, e.g. 'tract:*'
+        :param higher_geography: (str) 'in' clause, e.g. 'state:17 county:031'
+        :param typed: (bool) Fetch typed DataFrames (numeric estimates)
+        :param with_moe: (bool) Also fetch each estimate's margin of error
+        """
+        self.acs = acs
+        self.variables = list(variables or [])
+        self.geography = geography
+        self.higher_geography = higher_geography
+        self.typed = typed
+        self.with_moe = with_moe
+        self.level = get_geography_level(geography)
+        self.path = os.path.join(store_dir, self.get_key())
+        self.unavailable = set(self.get_unavailable_years())
+
+    def get_spec(self):
+        return {'acs': self.acs.value, 'variables': self.variables, 'geography': self.geography,
+                'higher_geography': self.higher_geography, 'typed': self.typed, 'with_moe': self.with_moe}
+
+    def get_key(self):
+        digest = hashlib.sha256(json.dumps(self.get_spec(), sort_keys=True).encode()).hexdigest()[:16]
+        return f"acs{self.acs.value}_{digest}"
+
+    def get_vintage_path(self, year):
+        return os.path.join(self.path, f"{year}.parquet")
+
+    def get_available_years(self):
+        return [int(year) for year in available_sets[self.acs]['years']]
+
+    def get_stored_years(self):
+        return sorted(int(os.path.basename(path).split('.')[0]) for path in glob.glob(os.path.join(self.path, '*.parquet')))
+
+    def get_info_path(self):
+        return os.path.join(self.path, 'panel.json')
+
+    def get_unavailable_years(self):
+        """Vintages the API reported as nonexistent on an earlier refresh."""
+        if not os.path.exists(self.get_info_path()):
+            return []
+        with open(self.get_info_path()) as file:
+            return json.load(file).get('unavailable', [])
+
+    def write_info(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(f"{self.get_info_path()}.tmp", 'w') as file:
+            json.dump({**self.get_spec(), 'unavailable': sorted(self.unavailable)}, file)
+        os.replace(f"{self.get_info_path()}.tmp", self.get_info_path())
+
+    def get_missing_years(self, years=None, retry_unavailable=False):
+        skipped = set(self.get_stored_years()) | (set() if retry_unavailable else self.unavailable)
+        return [year for year in (years or self.get_available_years()) if year not in skipped]
+
+    def fetch_vintage(self, year):
+        query = ACS_CLASSES[self.acs](year=str(year), variables=self.variables, location=self.geography,
+                                      higher_geography=self.higher_geography, typed=self.typed, with_moe=self.with_moe)
+        try:
+            query.collect_dataframe()
+        except Exception as e:
+            if is_unavailable_status(query.error_status):
+                raise vintageUnavailable(f"{query.get_url()} returned {query.error_status}") from e
+            raise
+        return query.get_dataframe()
+
+    def build_vintage(self, df, year):
+        """Adds the year and an int64 GEOID and stores geography codes as text so every vintage file has one schema."""
+        df = df.copy()
+        if self.level:
+            df.insert(0, 'GEOID', build_geoid(df, self.level))
+        for column in df.columns:
+            if isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(str)
+        df.insert(0, 'year', year)
+        return df
+
+    def store_vintage(self, year):
+        try:
+            df = self.build_vintage(self.fetch_vintage(year), year)
+        except vintageUnavailable as e:
+            print(f"WARNING: ACS{self.acs.value} {year} is not available and will be skipped: {e}")
+            self.unavailable.add(year)
+            return None
+        except Exception as e:
+            print(f"WARNING: Could not fetch ACS{self.acs.value} {year}, it will be retried on the next refresh: {e}")
+            return None
+        os.makedirs(self.path, exist_ok=True)
+        path = self.get_vintage_path(year)
+        df.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+        return year
+
+    def refresh(self, years=None, max_workers=MAX_WORKERS, retry_unavailable=False):
+        """
+        Fetches the vintages that are not stored yet, concurrently. Vintages the API
+        reported as nonexistent are recorded in panel.json and skipped afterwards.
+
+        :param years: (list) Vintages to include (default: every year in acsData.available_sets)
+        :param retry_unavailable: (bool) Request vintages recorded as unavailable again
+        :return: (list) The vintages that were fetched
+        """
+        missing = self.get_missing_years(years, retry_unavailable)
+        if not missing:
+            return []
+        self.unavailable -= set(missing)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+            fetched = list(executor.map(self.store_vintage, missing))
+        self.write_info()
+        return [year for year in fetched if year is not None]
+
+    def get_index_columns(self, df):
+        if 'GEOID' in df.columns:
+            return ['GEOID']
+        return [column for column in df.columns if column in GEOGRAPHY_COLUMNS]
+
+    def load(self, years=None, shape='long'):
+        """
+        :param years: (list) Vintages to return (default: all stored)
+        :param shape: (str) 'long': one row per (year, geography); 'wide': one row per geography
+            with its latest NAME and <variable>_<year> columns
+        :return: (DataFrame) The panel
+        """
+        if shape not in PANEL_SHAPES:
+            raise ValueError(f"Unknown panel shape: {shape}")
+        stored = self.get_stored_years()
+        paths = [self.get_vintage_path(year) for year in stored if years is None or year in years]
+        panel = read_vintage_files(paths)
+        if shape == 'long' or panel.empty:
+            return panel
+        index = self.get_index_columns(panel)
+        values = [column for column in panel.columns if column not in GEOGRAPHY_COLUMNS and column not in LABEL_COLUMNS]
+        wide = panel.pivot(index=index, columns='year', values=values)
+        wide.columns = [f"{variable}_{year}" for variable, year in wide.columns]
+        if 'NAME' in panel.columns:
+            # Names can change between vintages, the latest one is kept
+            wide.insert(0, 'NAME', panel.sort_values('year').groupby(index)['NAME'].last())
+        return wide.reset_index()
+
+    def get_panel(self, years=None, shape='long', max_workers=MAX_WORKERS):
+        """Refreshes the missing vintages and returns the panel in one step."""
+        self.refresh(years, max_workers)
+        return self.load(years, shape)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.fetched = []
+        self.fail_2021 = False
+        test = self
+
+        class offlinePanel(acsPanel):
+            def fetch_vintage(self, year):
+                test.fetched.append(year)
+                if year == 2020:
+                    raise vintageUnavailable("returned 404")
+                if year == 2021 and test.fail_2021:
+                    raise Exception("Failed to collect variables")
+                return pd.DataFrame({'NAME': ['Cook County, Illinois', 'Lake County, Illinois'],
+                                     'B01001_001E': pd.array([5000000 + year, 700000 + year], dtype='Int32'),
+                                     'state': pd.Categorical(['17', '17']),
+                                     'county': pd.Categorical(['031', '097'])})
+        self.panel = offlinePanel(acs_type.ACS1, ['NAME', 'B01001_001E'], 'county:031,097', 'state:17', store_dir=self.store_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    def test_refresh_fetches_missing_vintages(self):
+        self.assertEqual([2018, 2019], self.panel.refresh([2018, 2019]))
+        self.fail_2021 = True
+        self.assertEqual([], self.panel.refresh([2018, 2019, 2020, 2021]))
+        self.assertEqual([2018, 2019, 2020, 2021], self.fetched)
+        self.fail_2021 = False
+        self.assertEqual([2021], self.panel.refresh([2018, 2019, 2020, 2021]))
+        self.assertEqual([2018, 2019, 2020, 2021, 2021], self.fetched)
+        self.assertEqual([], self.panel.get_missing_years([2018, 2019, 2020, 2021]))
+        self.assertEqual([2020], type(self.panel)(self.panel.acs, self.panel.variables, self.panel.geography,
+                                                  self.panel.higher_geography, self.store_dir).get_unavailable_years())
+        self.assertEqual([2020], self.panel.get_missing_years([2018, 2020], retry_unavailable=True))
+        self.assertIn(2005, self.panel.get_missing_years())
+        self.assertEqual([True, True, False, False], [is_unavailable_status(status) for status in (400, 404, 429, 503)])
+
+    def test_long_and_wide(self):
+        long = self.panel.get_panel([2018, 2019])
+        self.assertEqual(4, len(long))
+        self.assertEqual([17031, 17097], list(long.loc[long['year'] == 2019, 'GEOID']))
+        wide = self.panel.load(shape='wide')
+        self.assertEqual(['GEOID', 'NAME', 'B01001_001E_2018', 'B01001_001E_2019'], list(wide.columns))
+        self.assertEqual('Lake County, Illinois', wide.loc[wide['GEOID'] == 17097, 'NAME'].iloc[0])
+        self.assertEqual(702019, wide.loc[wide['GEOID'] == 17097, 'B01001_001E_2019'].iloc[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from httpUtils import session_lock
+
+DEFAULT_CONCURRENCY = 16
+MAX_THREADS = 64
+
+executor = None
+
+def get_executor():
+    """Returns the thread pool the blocking HTTP calls are run on."""
+    global executor
+    if executor is None:
+        with session_lock:
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix='census-async')
+    return executor
+
+async def run_bounded(func, *args, semaphore=None, **kwargs):
+    """Runs a blocking call off the event loop, holding the semaphore (if any) while it runs."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    if semaphore is None:
+        return await loop.run_in_executor(get_executor(), call)
+    async with semaphore:
+        return await loop.run_in_executor(get_executor(), call)
+
+def get_query_coroutine(query, semaphore):
+    if hasattr(query, 'collect_dataframe_async'):
+        return query.collect_dataframe_async(semaphore=semaphore)
+    if hasattr(query, 'get_data_async'):
+        return query.get_data_async(semaphore=semaphore)
+    raise TypeError(f"Unsupported query object: {type(query).__name__}")
+
+async def gather_queries(queries, max_concurrency=DEFAULT_CONCURRENCY):
+    """
+    Runs many censusData / chicagoData queries concurrently.
+
+    :param queries: (list) censusData or chicagoData objects
+    :param max_concurrency: (int) Maximum number of requests in flight at once
+    :return: (list) DataFrames in the same order as the queries
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(*(get_query_coroutine(query, semaphore) for query in queries))
+
+def collect_queries(queries, max_concurrency=DEFAULT_CONCURRENCY):
+    """Blocking wrapper around gather_queries for scripts without an event loop."""
+    return asyncio.run(gather_queries(queries, max_concurrency=max_concurrency))
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_gather_queries_bounds_concurrency(self):
+        lock = threading.Lock()
+        counts = {'active': 0, 'peak': 0}
+
+        class slowQuery():
+            def __init__(self, value):
+                self.value = value
+
+            def get_data(self):
+                with lock:
+                    counts['active'] += 1
+                    counts['peak'] = max(counts['peak'], counts['active'])
+                time.sleep(0.05)
+                with lock:
+                    counts['active'] -= 1
+                return self.value
+
+            async def get_data_async(self, semaphore=None):
+                return await run_bounded(self.get_data, semaphore=semaphore)
+
+        results = collect_queries([slowQuery(i) for i in range(12)], max_concurrency=4)
+        self.assertEqual(list(range(12)), results)
+        self.assertEqual(4, counts['peak'])
+
+    def test_unsupported_query(self):
+        with self.assertRaises(TypeError):
+            collect_queries([object()])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+DEFAULT_CACHE_DIR = '.census_cache'
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024  # 512 MB of compressed payloads
+IGNORED_PARAMS = ('key',)
+
+# Puts run concurrently from the chunk thread pool; only one of them walks and trims the cache at a time
+eviction_lock = threading.Lock()
+
+
+def normalize_request(url, params=None, ignored_params=IGNORED_PARAMS):
+    """Builds a canonical string for a request, leaving out the api key and ordering params."""
+    url = url.strip().rstrip('/')
+    scheme, sep, rest = url.partition('://')
+    host, slash, path = rest.partition('/')
+    url = f"{scheme.lower()}{sep}{host.lower()}{slash}{path}"
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items() if k not in ignored_params)
+    return f"{url}?{urlencode(items)}"
+
+def get_cache_key(url, params=None):
+    return hashlib.sha256(normalize_request(url, params).encode('utf-8')).hexdigest()
+
+
+class responseCache():
+    """
+    Content-keyed on-disk cache of raw API payloads.
+
+    Entries are gzip files named by the hash of the normalized request. The file
+    mtime records when the payload was stored (used for the TTL) and the atime
+    records the last read (used for LRU eviction once max_size is exceeded).
+    The cache size is tracked across puts, so the directory is only walked when
+    it first needs counting and when the limit is crossed.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, ttl=None, compress_level=6):
+        """
+        :param cache_dir: (str) Directory the compressed payloads are written to
+        :param max_size: (int) Upper bound in bytes on the compressed cache size
+        :param ttl: (float) Seconds an entry stays valid (default: None = never expires)
+        :param compress_level: (int) gzip compression level
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttl = ttl
+        self.compress_level = compress_level
+        self.size = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_path(self, url, params=None):
+        key = get_cache_key(url, params)
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def is_expired(self, path, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is None:
+            return False
+        return time.time() - os.path.getmtime(path) > ttl
+
+    def get(self, url, params=None, ttl=None):
+        """Returns the cached payload bytes, or None on a miss or an expired entry."""
+        path = self.get_path(url, params)
+        try:
+            if self.is_expired(path, ttl):
+                os.remove(path)
+                return None
+            with gzip.open(path, 'rb') as file:
+                payload = file.read()
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            return payload
+        except (OSError, EOFError):
+            return None
+
+    def put(self, url, params, payload):
+        """Stores the payload bytes for the request and evicts old entries if needed."""
+        path = self.get_path(url, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.compress_level) as file:
+                file.write(payload)
+            size = os.path.getsize(tmp_path)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.track(size - replaced)
+
+    def track(self, change):
+        """Adds a put to the tracked size and evicts once it is over max_size."""
+        if self.max_size is None:
+            return
+        with eviction_lock:
+            if self.size is None:
+                self.size = self.get_size()
+            else:
+                self.size += change
+            if self.size > self.max_size:
+                self.evict_entries()
+
+    def list_entries(self):
+        entries = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json.gz'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, path))
+        return entries
+
+    def get_size(self):
+        return sum(size for atime, size, path in self.list_entries())
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_size."""
+        if self.max_size is None:
+            return
+        with eviction_lock:
+            self.evict_entries()
+
+    def evict_entries(self):
+        entries = self.list_entries()
+        total = sum(size for atime, size, path in entries)
+        for atime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.size = None
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_key_ignores_census_key_and_param_order(self):
+        url = 'https://api.census.gov/data/2010/dec/sf1'
+        self.assertEqual(get_cache_key(url, {'get': 'NAME', 'for': 'us:1', 'key': 'abc'}),
+                         get_cache_key(url + '/', {'for': 'us:1', 'get': 'NAME'}))
+
+    def test_put_and_get(self):
+        cache = responseCache(self.cache_dir)
+        url = 'https://api.census.gov/data/2010/dec/sf1'
+        self.assertIsNone(cache.get(url, {'for': 'us:1'}))
+        cache.put(url, {'for': 'us:1'}, b'[["NAME"],["United States"]]')
+        self.assertEqual(b'[["NAME"],["United States"]]', cache.get(url, {'for': 'us:1'}))
+
+    def test_ttl_expires_entries(self):
+        cache = responseCache(self.cache_dir, ttl=60)
+        url = 'https://api.census.gov/data/2010/dec/sf1'
+        cache.put(url, {}, b'[]')
+        path = cache.get_path(url, {})
+        os.utime(path, (time.time(), time.time() - 120))
+        self.assertIsNone(cache.get(url, {}))
+        self.assertFalse(os.path.exists(path))
+
+    def test_lru_eviction(self):
+        cache = responseCache(self.cache_dir, max_size=None)
+        url = 'https://api.census.gov/data/2010/dec/sf1'
+        for i in range(3):
+            cache.put(url, {'for': f'state:{i}'}, os.urandom(1000))
+            path = cache.get_path(url, {'for': f'state:{i}'})
+            os.utime(path, (1000 + i, 1000 + i))
+        cache.get(url, {'for': 'state:0'})
+        cache.max_size = 2500
+        cache.evict()
+        self.assertIsNotNone(cache.get(url, {'for': 'state:0'}))
+        self.assertIsNone(cache.get(url, {'for': 'state:1'}))
+        self.assertIsNotNone(cache.get(url, {'for': 'state:2'}))
+
+    def test_concurrent_puts_evict_once_over_limit(self):
+        cache = responseCache(self.cache_dir, max_size=5000)
+        url = 'https://api.census.gov/data/2010/dec/sf1'
+        walks = []
+        list_entries = cache.list_entries
+        cache.list_entries = lambda: walks.append(1) or list_entries()
+        cache.put(url, {'for': 'state:0'}, os.urandom(1000))
+        cache.put(url, {'for': 'state:1'}, os.urandom(1000))
+        self.assertEqual(1, len(walks))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda i: cache.put(url, {'for': f'state:{i}'}, os.urandom(1000)), range(2, 40)))
+        self.assertLessEqual(cache.get_size(), 5000)
+        self.assertLess(len(walks), 40)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from censusCache import DEFAULT_CACHE_DIR
+from httpUtils import http_get
+
+CATALOG_URL = 'https://api.census.gov/data.json'
+DEFAULT_CATALOG_TTL = 7 * 24 * 60 * 60  # a week; new datasets are published a few times a year
+NO_VINTAGE = 'N/A'
+
+CATALOG_COLUMNS = ['dataset', 'year', 'title', 'description', 'type', 'api_base_url',
+                   'geography_link', 'variables_link', 'groups_link', 'examples_link', 'documentation']
+
+# list name -> catalog column used by the legacy data.html style dicts
+LIST_NAMES = {'geographies_url': 'geography',
+              'variables_url': 'variables',
+              'groups_url': 'groups',
+              'examples_url': 'examples'}
+
+
+def get_dataset_type(entry):
+    if entry.get('c_isTimeseries'):
+        return 'Timeseries'
+    if entry.get('c_isMicrodata'):
+        return 'Microdata'
+    return 'Aggregate'
+
+def parse_discovery_document(document):
+    """Flattens the data.json discovery document into one catalog row per (dataset, vintage)."""
+    rows = []
+    for entry in document.get('dataset', []):
+        distribution = entry.get('distribution') or [{}]
+        vintage = entry.get('c_vintage')
+        rows.append({'dataset': '/'.join(entry.get('c_dataset', [])),
+                     'year': NO_VINTAGE if vintage is None else str(vintage),
+                     'title': entry.get('title', ''),
+                     'description': entry.get('description', ''),
+                     'type': get_dataset_type(entry),
+                     'api_base_url': distribution[0].get('accessURL', ''),
+                     'geography_link': entry.get('c_geographyLink', ''),
+                     'variables_link': entry.get('c_variablesLink', ''),
+                     'groups_link': entry.get('c_groupsLink', ''),
+                     'examples_link': entry.get('c_examplesLink', ''),
+                     'documentation': entry.get('c_documentationLink', '')})
+    return pd.DataFrame(rows, columns=CATALOG_COLUMNS)
+
+
+class censusCatalog():
+    """
+    Local store of the api.census.gov dataset catalog.
+
+    The catalog is built from the machine readable data.json document, persisted
+    as parquet and only downloaded again on refresh() or once the file is older
+    than the ttl. Lookups go through an in-memory {(dataset, year): entry} index.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_CATALOG_TTL):
+        """
+        :param cache_dir: (str) Directory the catalog file is stored under
+        :param ttl: (float) Seconds before the stored catalog is downloaded again (default: a week, None = never)
+        """
+        self.path = os.path.join(cache_dir, 'catalog', 'datasets.parquet')
+        self.ttl = ttl
+        self.table = None
+        self.index = {}
+        self.dict_by_dataset = None
+
+    def is_stale(self):
+        if not os.path.exists(self.path):
+            return True
+        return self.ttl is not None and time.time() - os.path.getmtime(self.path) > self.ttl
+
+    def fetch_document(self):
+        response = http_get(CATALOG_URL)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self):
+        """Downloads data.json and replaces the stored catalog."""
+        table = parse_discovery_document(self.fetch_document())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+        self.set_table(table)
+        return self
+
+    def load(self, refresh=False):
+        if refresh or self.is_stale():
+            return self.refresh()
+        if self.table is None:
+            self.set_table(pd.read_parquet(self.path))
+        return self
+
+    def set_table(self, table):
+        self.table = table
+        self.index = {(entry['dataset'], entry['year']): entry for entry in table.to_dict(orient='records')}
+        self.dict_by_dataset = None
+
+    def get(self, dataset, year):
+        """Returns the catalog entry for a dataset vintage, or None."""
+        return self.index.get((dataset, str(year)))
+
+    def get_datasets(self):
+        return sorted(self.table['dataset'].unique())
+
+    def get_years(self, dataset):
+        return sorted(year for (name, year) in self.index if name == dataset)
+
+    def get_dict_by_dataset(self):
+        """Returns {dataset: {year: entry}} with the list urls used by the data.html page."""
+        if self.dict_by_dataset is not None:
+            return self.dict_by_dataset
+        new_dict = {}
+        for (dataset, year), entry in self.index.items():
+            legacy_entry = {'title': entry['title'],
+                            'description': entry['description'],
+                            'year': year,
+                            'dataset': dataset,
+                            'type': entry['type'],
+                            'documentation': entry['documentation'],
+                            'api_base_url': entry['api_base_url']}
+            for label, list_name in LIST_NAMES.items():
+                legacy_entry[label] = f"{entry['api_base_url']}/{list_name}.html"
+            new_dict.setdefault(dataset, {})[year] = legacy_entry
+        self.dict_by_dataset = new_dict
+        return new_dict
+
+catalog = None
+
+def get_catalog(refresh=False):
+    """Returns the shared catalog, loading it from disk (or data.json) on first use."""
+    global catalog
+    if catalog is None:
+        catalog = censusCatalog()
+    return catalog.load(refresh=refresh)
+
+
+class MyTestCase(unittest.TestCase):
+    document = {'dataset': [
+        {'c_vintage': 2005, 'c_dataset': ['acs', 'acs1'], 'c_isAggregate': True, 'title': 'ACS 1-Year Detailed Tables',
+         'c_variablesLink': 'http://api.census.gov/data/2005/acs/acs1/variables.json',
+         'distribution': [{'accessURL': 'http://api.census.gov/data/2005/acs/acs1'}]},
+        {'c_dataset': ['timeseries', 'eits', 'resconst'], 'c_isTimeseries': True, 'title': 'Residential Construction',
+         'distribution': [{'accessURL': 'http://api.census.gov/data/timeseries/eits/resconst'}]}]}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        document = self.document
+
+        class offlineCatalog(censusCatalog):
+            def fetch_document(self):
+                return document
+        self.catalog = offlineCatalog(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_lookup_by_dataset_and_vintage(self):
+        self.catalog.load()
+        self.assertEqual('Aggregate', self.catalog.get('acs/acs1', 2005)['type'])
+        self.assertEqual('Timeseries', self.catalog.get('timeseries/eits/resconst', NO_VINTAGE)['type'])
+        self.assertIsNone(self.catalog.get('acs/acs1', 2006))
+
+    def test_reload_from_disk(self):
+        self.catalog.load()
+        stored = censusCatalog(self.cache_dir).load()
+        self.assertEqual(['2005'], stored.get_years('acs/acs1'))
+
+    def test_varaibles_url(self):
+        census_dict = self.catalog.load().get_dict_by_dataset()
+        self.assertEqual('http://api.census.gov/data/2005/acs/acs1/variables.html', census_dict['acs/acs1']['2005']['variables_url'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,30 @@
 import unittest
 from enum import Enum
 from censusUtils import get_census_key_from_env
-from censusUtils import download_and_extract_tiger
-import requests
+from tigerCache import tigerCache
+from geoidUtils import build_geoid, join_on_geoid
+from censusCache import responseCache
+from asyncUtils import run_bounded
+from censusVariables import get_variable_types, add_moe_variables, get_moe_variable
+from censusFrame import apply_census_types, columnarParser, parse_payload_chunks, iter_bytes
+import asyncio
+from httpUtils import http_get
+import json
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import os
+import shutil
+import tempfile
 import geopandas as gpd
 import matplotlib.pyplot as plt
 
 
+MAX_VARIABLES = 50  # Census API limit on the number of 'get' variables per request
+MAX_WORKERS = 8
+STREAM_CHUNK_SIZE = 1 << 16
+
+def chunk_variables(variables, chunk_size=MAX_VARIABLES):
+    return [variables[i:i + chunk_size] for i in range(0, len(variables), chunk_size)]
+
 class censusApi(Enum):
     URL = 'https://api.census.gov'
 
@@ -39,11 +55,26 @@ class censusData():
     census_api_url = ''
     dataset = ''
     params = {}
-    data = {}
+    data = {}  # raw API payload, or a list with one payload per chunk when the variables were split into chunks
     df = pd.DataFrame()
-
-    def __init__(self, year='', dataset='', variables=[], geography='', higher_geography=''):
+    cache = None
+    typed = False
+    use_metadata = True
+    variable_types = {}
+    stream = False
+    retain_data = True
+    with_moe = False
+    error_status = None
+
+    def __init__(self, year='', dataset='', variables=[], geography='', higher_geography='', cache=None, typed=False, with_moe=False):
         self.census_api_base = 'https://api.census.gov'
+        self.cache = cache
+        self.typed = typed
+        self.with_moe = with_moe
+        self.variable_types = {}
+        self.params = {}
+        self.variables = []
+        self.moe_variables = set()  # M variables added by with_moe rather than requested
         if year:
             self.set_year(year)
         if dataset:
@@ -62,10 +93,12 @@ class censusData():
 
     def set_year(self, year):
         self.year = year
+        self.variable_types = {}
         self.update_url()
 
     def set_dataset(self, datasets):
         self.dataset = datasets
+        self.variable_types = {}
         self.update_url()
 
     def get_url(self):
@@ -81,9 +114,11 @@ class censusData():
         return self.params
     def update_year(self, year):
         self.year = year
+        self.variable_types = {}
 
     def update_dataset(self, dataset):
         self.dataset = dataset
+        self.variable_types = {}
 
     def get_census_key(self):
         return self.census_key
@@ -92,17 +127,39 @@ class censusData():
         self.params['get'] = ",".join(self.variables)
 
     def set_variables(self, variables):
-        self.variables = variables
+        if self.with_moe:
+            self.variables = add_moe_variables(variables)
+            self.moe_variables = {variable for variable in self.variables
+                                  if variable not in variables or variable in self.moe_variables}
+        else:
+            self.variables = variables
+            self.moe_variables = set()
+        self.variable_types = {}
         self.update_variables()
 
     def clear_variables(self):
         self.variables = []
+        self.moe_variables = set()
         del self.params['get']
 
     def add_variable(self, variable):
         self.variables.append(variable)
+        self.variable_types = {}
+        moe = get_moe_variable(variable)
+        if self.with_moe and moe and moe not in self.variables:
+            self.variables.append(moe)
+            self.moe_variables.add(moe)
         self.update_variables()
 
+    def set_moe(self, with_moe=True):
+        """
+        With margins of error on, every ACS estimate variable is requested with its matching M variable.
+        Turning them off removes the M variables that were added this way, but not ones requested explicitly.
+        """
+        self.with_moe = with_moe
+        if self.variables:
+            self.set_variables([variable for variable in self.variables if with_moe or variable not in self.moe_variables])
+
     def set_geography(self, geography):
             self.params['for'] = geography
 
@@ -125,24 +182,233 @@ class censusData():
     def clear_census_key(self):
         del self.params['key']
 
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def clear_cache(self):
+        self.cache = None
+
+    def set_typed(self, typed=True, use_metadata=True):
+        """
+        Typed mode converts estimates to numeric dtypes and geography codes to categoricals.
+        With use_metadata the predicate types come from the dataset's variables.json.
+        """
+        self.typed = typed
+        self.use_metadata = use_metadata
+
+    def load_variable_types(self):
+        try:
+            self.variable_types = get_variable_types(self.dataset, self.year, self.variables)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not load variable metadata, inferring types: {e}")
+        return self.variable_types
+
+    def set_streaming(self, stream=True, retain_data=False):
+        """
+        Streaming mode parses response bodies incrementally into columns instead of
+        loading them with response.json(). With retain_data=False self.data is not kept.
+        """
+        self.stream = stream
+        self.retain_data = retain_data
+
+    def set_variable_types(self, variable_types):
+        """Sets {variable: predicateType} used for typed DataFrame construction."""
+        self.variable_types = variable_types
+
     def get_api_response(self, url, params):
-        response = requests.get(url, params)
+        if self.cache is not None:
+            payload = self.cache.get(url, params)
+            if payload is not None:
+                return json.loads(payload)
+        response = http_get(url, params)
         if response.status_code == 200:
+            if self.cache is not None:
+                self.cache.put(url, params, response.content)
             return response.json()
         else:
+            self.error_status = response.status_code
             print("ERROR: Received invalid response: " + str(response.status_code))
 
-    def collect_dataframe(self):
+    def get_chunk_params(self, chunk):
+        params = dict(self.get_params())
+        params['get'] = ",".join(chunk)
+        return params
+
+    def get_api_frame(self, url, params):
+        """Streaming variant of get_api_response that parses the payload straight into columns."""
+        if self.cache is not None:
+            payload = self.cache.get(url, params)
+            if payload is not None:
+                return parse_payload_chunks(iter_bytes(payload))
+        response = http_get(url, params, stream=True)
+        if response.status_code != 200:
+            self.error_status = response.status_code
+            print("ERROR: Received invalid response: " + str(response.status_code))
+            return None
+        parser = columnarParser()
+        payload = []
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            parser.feed(chunk)
+            if self.cache is not None:
+                payload.append(chunk)
+        parser.close()
+        if self.cache is not None:
+            self.cache.put(url, params, b''.join(payload))
+        return parser.get_dataframe()
+
+    def get_fetcher(self):
+        return self.get_api_frame if self.stream else self.get_api_response
+
+    def collect_dataframe(self, max_workers=MAX_WORKERS):
+        """
+        Fetches the variables into self.df. Variable lists longer than the API limit
+        are split into chunks that are fetched concurrently and joined back together
+        on the geography columns.
+        """
+        self.dict = {}
+        self.error_status = None
+        url = self.get_url()
+        chunks = chunk_variables(self.variables)
+        fetch = self.get_fetcher()
+        if len(chunks) <= 1:
+            responses = [fetch(url, self.get_params())]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                responses = list(executor.map(lambda chunk: fetch(url, self.get_chunk_params(chunk)), chunks))
+        self.set_responses(responses, chunks)
+
+    async def collect_dataframe_async(self, semaphore=None):
+        """
+        Async variant of collect_dataframe. Chunks are fetched concurrently, each
+        holding the semaphore (if given) while its request is in flight.
+        """
         self.dict = {}
-        data = self.get_api_response(self.get_url(), self.get_params())
-        self.data = data
-        self.df = pd.DataFrame(data[1:], columns=data[0])
+        self.error_status = None
+        url = self.get_url()
+        chunks = chunk_variables(self.variables)
+        fetch = self.get_fetcher()
+        if len(chunks) <= 1:
+            responses = [await run_bounded(fetch, url, self.get_params(), semaphore=semaphore)]
+        else:
+            responses = await asyncio.gather(*(run_bounded(fetch, url, self.get_chunk_params(chunk), semaphore=semaphore)
+                                               for chunk in chunks))
+        self.set_responses(responses, chunks)
+        return self.df
+
+    def set_responses(self, responses, chunks):
+        """Builds self.df from the per-chunk responses (raw lists, or DataFrames in streaming mode)."""
+        if self.stream:
+            frames = responses
+            self.data = None
+        else:
+            frames = [None if data is None else pd.DataFrame(data[1:], columns=data[0]) for data in responses]
+            self.data = responses[0] if len(responses) == 1 else responses
+            if not self.retain_data:
+                self.data = None
+        for frame, chunk in zip(frames, chunks or [self.variables]):
+            if frame is None:
+                raise Exception(f"Failed to collect variables {','.join(chunk)}")
+        self.df = frames[0] if len(frames) == 1 else merge_chunk_frames(frames, chunks)
+        if self.typed:
+            if self.use_metadata and not self.variable_types:
+                self.load_variable_types()
+            apply_census_types(self.df, self.variables, self.variable_types)
 
     def get_dataframe(self):
         return self.df
 
+def merge_chunk_frames(frames, chunks):
+    """
+    Joins the per-chunk DataFrames on their shared geography columns. When those do not
+    identify the rows uniquely, the chunks are joined row by row, which requires every
+    chunk to list the same geographies in the same order.
+    """
+    geo_frames = []
+    geo_columns = []
+    for frame, chunk in zip(frames, chunks):
+        geo_columns = [column for column in frame.columns if column not in chunk]
+        geo_frames.append(frame[geo_columns])
+    variables = [variable for chunk in chunks for variable in chunk]
+    if geo_columns and all(not geo.duplicated().any() for geo in geo_frames):
+        indexed = [frame.set_index(geo_columns) for frame in frames]
+        df = pd.concat(indexed, axis=1).reset_index()
+        return df[variables + geo_columns]
+    for geo in geo_frames[1:]:
+        if len(geo) != len(geo_frames[0]) or not geo.reset_index(drop=True).equals(geo_frames[0].reset_index(drop=True)):
+            raise Exception("Cannot merge variable chunks: the geography columns are not unique and the chunks' rows differ")
+    df = pd.concat([frame[chunk].reset_index(drop=True) for frame, chunk in zip(frames, chunks)], axis=1)
+    df[geo_columns] = geo_frames[0].reset_index(drop=True)
+    return df[variables + geo_columns]
+
 class MyTestCase(unittest.TestCase):
 
+    def test_collect_dataframe_in_chunks(self):
+        class fakeCensusData(censusData):
+            def get_api_response(self, url, params):
+                chunk = params['get'].split(',')
+                return [chunk + ['state', 'county']] + [[f"{v}-{county}" for v in chunk] + ['17', county] for county in ['031', '043']]
+        variables = ['NAME'] + [f"B01001_{i:03d}E" for i in range(1, 120)]
+        cd = fakeCensusData(year='2019', dataset='acs/acs5', variables=variables, geography='county:031,043', higher_geography='state:17')
+        cd.collect_dataframe()
+        df = cd.get_dataframe()
+        self.assertEqual(3, len(cd.data))
+        self.assertEqual(variables + ['state', 'county'], list(df.columns))
+        self.assertEqual(2, len(df))
+        self.assertEqual('B01001_119E-043', df.loc[df['county'] == '043', 'B01001_119E'].iloc[0])
+        async_df = asyncio.run(cd.collect_dataframe_async())
+        self.assertTrue(df.equals(async_df))
+
+    def test_merge_chunks_with_repeated_geographies(self):
+        chunks = [['NAME', 'A'], ['B']]
+        frames = [pd.DataFrame({'NAME': ['x', 'y'], 'A': ['1', '2'], 'state': ['17', '17']}),
+                  pd.DataFrame({'B': ['3', '4'], 'state': ['17', '17']})]
+        df = merge_chunk_frames(frames, chunks)
+        self.assertEqual(['NAME', 'A', 'B', 'state'], list(df.columns))
+        self.assertEqual(['3', '4'], list(df['B']))
+        frames[1] = pd.DataFrame({'B': ['3'], 'state': ['17']})
+        with self.assertRaises(Exception):
+            merge_chunk_frames(frames, chunks)
+
+    def test_setters_reset_variable_types(self):
+        cd = censusData(year='2019', dataset='acs/acs5', variables=['B01001_001E'], geography='us:1')
+        for change in (lambda: cd.set_year('2020'), lambda: cd.set_dataset('acs/acs1'),
+                       lambda: cd.set_variables(['B19013_001E']), lambda: cd.add_variable('B01001_001E')):
+            cd.set_variable_types({'B01001_001E': 'int'})
+            change()
+            self.assertEqual({}, cd.variable_types)
+
+    def test_moe_variables(self):
+        cd = censusData(year='2019', dataset='acs/acs5', variables=['NAME', 'B17001_002E'], geography='tract:*', with_moe=True)
+        cd.add_variable('B17001_001E')
+        self.assertEqual('NAME,B17001_002E,B17001_002M,B17001_001E,B17001_001M', cd.get_params()['get'])
+        cd.set_moe(True)
+        cd.set_moe(False)
+        self.assertEqual('NAME,B17001_002E,B17001_001E', cd.get_params()['get'])
+        cd.set_variables(['B17001_002E', 'B17001_002M'])
+        cd.set_moe(True)
+        cd.set_moe(False)
+        self.assertEqual(['B17001_002E', 'B17001_002M'], cd.variables)
+
+    def test_collect_dataframe_from_cache(self):
+        cache = responseCache(tempfile.mkdtemp())
+        cd = censusData(year='2005',
+                        dataset='acs/acs1',
+                        variables=['NAME','B01001_001E'],
+                        geography='us:1',
+                        cache=cache)
+        cache.put(cd.get_url(), cd.get_params(), b'[["NAME","B01001_001E","us"],["United States","288378137","1"]]')
+        cd.collect_dataframe()
+        pop_dict = cd.get_dataframe().to_dict(orient='index')
+        self.assertEqual('288378137', pop_dict[0]['B01001_001E'])
+        cd.set_typed(use_metadata=False)
+        cd.collect_dataframe()
+        self.assertEqual(288378137, cd.get_dataframe()['B01001_001E'][0])
+        cd.set_streaming()
+        cd.collect_dataframe()
+        self.assertIsNone(cd.data)
+        self.assertEqual(288378137, cd.get_dataframe()['B01001_001E'][0])
+        shutil.rmtree(cache.cache_dir)
+
     def test_get_us_population(self):
         us_geography = censusLoc.US.value
         acs_2005 = censusData(year='2005',
@@ -171,26 +437,17 @@ class MyTestCase(unittest.TestCase):
                               dataset='dec/sf1',
                               variables=['NAME','P001001'],
                               geography='block:*',
-                              higher_geography='state:17 county:031'
+                              higher_geography='state:17 county:031',
+                              typed=True
                               )
         cd.collect_dataframe()
         df = cd.get_dataframe()
-        df['P001001'] = df['P001001'].astype(int)
-        df["GEOID10"] = df["state"].astype(str) + df["county"].astype(str) + df["tract"].astype(str) + df[
-            "block"].astype(str)
+        df["GEOID10"] = build_geoid(df, 'block')
         print(df.head())
-        # Define the TIGER/Line Shapefile URL (Cook County, IL Blocks - 2010)
-        tiger_url = "https://www2.census.gov/geo/tiger/TIGER2010/TABBLOCK/2010/tl_2010_17031_tabblock10.zip"
-        output_dir = "tiger_shapefiles"
-        zip_path = os.path.abspath(os.path.join(output_dir, "tl_2010_17031_tabblock10.zip"))
-        os.makedirs(output_dir, exist_ok=True)
-        download_and_extract_tiger(tiger_url, zip_path, output_dir)
-        shp_file = os.path.abspath(os.path.join(output_dir, "tl_2010_17031_tabblock10.shp"))
-        #pin fiona to version 1.9.6
-        blocks_gdf = gpd.read_file(shp_file)
+        # Cook County, IL TIGER/Line layer (2010), read from the local TIGER cache
+        blocks_gdf = tigerCache().load_simplified(2010, 'tabblock', state='17', county='031', figsize=(12, 10))
         print(blocks_gdf.head())
-        merged_df = pd.merge(df, blocks_gdf, on='GEOID10')
-        merged_df = gpd.GeoDataFrame(merged_df, geometry="geometry")
+        merged_df = join_on_geoid(df, blocks_gdf, left_on='GEOID10', right_on='GEOID10')
         print(merged_df.head())
         fig, ax = plt.subplots(figsize=(12, 10))  # Increase figure size
         merged_df.plot(column="P001001",
@@ -213,25 +470,17 @@ class MyTestCase(unittest.TestCase):
                               dataset='dec/sf1',
                               variables=['NAME','P001001'],
                               geography='block group:*',
-                              higher_geography='state:17 county:031'
+                              higher_geography='state:17 county:031',
+                              typed=True
                               )
         cd.collect_dataframe()
         df = cd.get_dataframe()
-        df['P001001'] = df['P001001'].astype(int)
-        df["GEOID10"] = df["state"].astype(str) + df["county"].astype(str) + df["tract"].astype(str) + df["block group"].astype(str)
+        df["GEOID10"] = build_geoid(df, 'block group')
         print(df.head())
-        # Define the TIGER/Line Shapefile URL (Cook County, IL Blocks - 2010)
-        tiger_url = "https://www2.census.gov/geo/tiger/TIGER2010/BG/2010/tl_2010_17031_bg10.zip"
-        output_dir = "tiger_shapefiles_bg"
-        zip_path = os.path.abspath(os.path.join(output_dir, "tl_2010_17031_bg10.zip"))
-        os.makedirs(output_dir, exist_ok=True)
-        download_and_extract_tiger(tiger_url, zip_path, output_dir)
-        shp_file = os.path.abspath(os.path.join(output_dir, "tl_2010_17031_bg10.shp"))
-        #pin fiona to version 1.9.6
-        blocks_gdf = gpd.read_file(shp_file)
+        # Cook County, IL TIGER/Line layer (2010), read from the local TIGER cache
+        blocks_gdf = tigerCache().load_simplified(2010, 'bg', state='17', county='031', figsize=(12, 10))
         print(blocks_gdf.head())
-        merged_df = pd.merge(df, blocks_gdf, on='GEOID10')
-        merged_df = gpd.GeoDataFrame(merged_df, geometry="geometry")
+        merged_df = join_on_geoid(df, blocks_gdf, left_on='GEOID10', right_on='GEOID10')
         print(merged_df.head())
         fig, ax = plt.subplots(figsize=(12, 10))  # Increase figure size
         merged_df.plot(column="P001001",
@@ -254,25 +503,17 @@ class MyTestCase(unittest.TestCase):
                               dataset='dec/sf1',
                               variables=['NAME','P001001'],
                               geography='tract:*',
-                              higher_geography='state:17 county:031'
+                              higher_geography='state:17 county:031',
+                              typed=True
                               )
         cd.collect_dataframe()
         df = cd.get_dataframe()
-        df['P001001'] = df['P001001'].astype(int)
-        df["GEOID10"] = df["state"].astype(str) + df["county"].astype(str) + df["tract"].astype(str)
+        df["GEOID10"] = build_geoid(df, 'tract')
         print(df.head())
-        # Define the TIGER/Line Shapefile URL (Cook County, IL Blocks - 2010)
-        tiger_url = "https://www2.census.gov/geo/tiger/TIGER2010/TRACT/2010/tl_2010_17031_tract10.zip"
-        output_dir = "tiger_shapefiles_bg"
-        zip_path = os.path.abspath(os.path.join(output_dir, "tl_2010_17031_tract10.zip"))
-        os.makedirs(output_dir, exist_ok=True)
-        download_and_extract_tiger(tiger_url, zip_path, output_dir)
-        shp_file = os.path.abspath(os.path.join(output_dir, "tl_2010_17031_tract10.shp"))
-        #pin fiona to version 1.9.6
-        blocks_gdf = gpd.read_file(shp_file)
+        # Cook County, IL TIGER/Line layer (2010), read from the local TIGER cache
+        blocks_gdf = tigerCache().load(2010, 'tract', state='17', county='031')
         print(blocks_gdf.head())
-        merged_df = pd.merge(df, blocks_gdf, on='GEOID10')
-        merged_df = gpd.GeoDataFrame(merged_df, geometry="geometry")
+        merged_df = join_on_geoid(df, blocks_gdf, left_on='GEOID10', right_on='GEOID10')
         print(merged_df.head())
         fig, ax = plt.subplots(figsize=(12, 10))  # Increase figure size
         merged_df.plot(column="P001001",
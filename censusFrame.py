@@ -0,0 +1,223 @@
+import codecs
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from censusVariables import is_moe_variable
+
+# Annotation values the Census API returns in place of an estimate or margin of error
+CENSUS_SENTINELS = (-999999999, -888888888, -666666666, -555555555, -333333333, -222222222)
+# Margin of error of an estimate that is controlled to be equal to a fixed value, so its error is zero
+CONTROLLED_MOE = -555555555
+
+GEOGRAPHY_COLUMNS = ('us', 'region', 'division', 'state', 'county', 'county subdivision', 'subminor civil division',
+                     'tract', 'block group', 'block', 'place', 'principal city (or part)',
+                     'metropolitan statistical area/micropolitan statistical area',
+                     'metropolitan division', 'combined statistical area', 'zip code tabulation area',
+                     'congressional district', 'state legislative district (upper chamber)',
+                     'state legislative district (lower chamber)', 'public use microdata area',
+                     'school district (unified)', 'american indian area/alaska native area/hawaiian home land')
+
+STRING_COLUMNS = ('NAME', 'GEO_ID', 'GEOID')
+
+INT32_MIN = np.iinfo(np.int32).min
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def get_geography_columns(columns, variables=None):
+    """Geography columns are the ones the API appends after the requested variables."""
+    if variables:
+        return [column for column in columns if column not in variables]
+    return [column for column in columns if column in GEOGRAPHY_COLUMNS]
+
+def get_int_dtype(values, nullable):
+    if len(values) and (values.min() < INT32_MIN or values.max() > INT32_MAX):
+        return 'Int64' if nullable else np.int64
+    return 'Int32' if nullable else np.int32
+
+def convert_numeric_column(column, predicate_type=None, float_dtype='float32', is_moe=False):
+    """
+    Converts a column of API strings to a compact numeric dtype, with the Census
+    sentinel values replaced by NA (controlled margins of error by 0).
+    Returns None if the column is not numeric.
+    """
+    values = pd.to_numeric(column, errors='coerce')
+    if predicate_type is None and values.isna().sum() > column.isna().sum():
+        return None
+    if is_moe:
+        values = values.mask(values == CONTROLLED_MOE, 0)
+    values = values.mask(values.isin(CENSUS_SENTINELS))
+    valid = values.dropna()
+    # The metadata can call a column 'int' that holds fractional values, so integrality is always checked
+    is_int = predicate_type in ('int', None) and bool((valid == np.floor(valid)).all())
+    if not is_int:
+        return values.astype(float_dtype)
+    nullable = len(valid) < len(values)
+    return values.astype(get_int_dtype(valid, nullable))
+
+def apply_census_types(df, variables=None, variable_types=None, float_dtype='float32'):
+    """
+    Converts an all-string Census DataFrame in place: estimates become int32/int64/float32
+    (nullable where sentinels were found), geography code columns become categoricals.
+
+    :param df: (DataFrame) Frame built from the API response
+    :param variables: (list) Requested variables; everything else is treated as geography
+    :param variable_types: (dict) {variable: predicateType} from the variable metadata ('int', 'float', 'string')
+    :param float_dtype: (str) dtype used for non-integer estimates
+    """
+    variable_types = variable_types or {}
+    geo_columns = get_geography_columns(list(df.columns), variables)
+    for column in df.columns:
+        if column in geo_columns:
+            df[column] = df[column].astype('category')
+            continue
+        predicate_type = variable_types.get(column)
+        if column in STRING_COLUMNS or predicate_type == 'string':
+            continue
+        converted = convert_numeric_column(df[column], predicate_type, float_dtype, is_moe_variable(column))
+        if converted is not None:
+            df[column] = converted
+    return df
+
+def build_typed_dataframe(data, variables=None, variable_types=None, float_dtype='float32'):
+    """Builds a typed DataFrame from a Census API response (header row followed by data rows)."""
+    df = pd.DataFrame(data[1:], columns=data[0])
+    return apply_census_types(df, variables, variable_types, float_dtype)
+
+
+class columnarParser():
+    """
+    Incremental parser for a Census API payload ([[header...], [row...], ...]).
+
+    Bytes are fed in as they arrive and each row is decoded on its own and
+    appended to per-column lists, so neither the full body nor a list of row
+    lists is ever held in memory.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.started = False
+        self.finished = False
+        self.columns = None
+        self.values = None
+
+    def feed(self, chunk):
+        self.buffer += self.text_decoder.decode(chunk)
+        self.parse_rows()
+
+    def parse_rows(self):
+        buffer = self.buffer
+        pos = 0
+        length = len(buffer)
+        while not self.finished:
+            while pos < length and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= length:
+                break
+            if not self.started:
+                if buffer[pos] != '[':
+                    raise ValueError(f"Unexpected character {buffer[pos]!r} at start of Census payload")
+                self.started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                self.finished = True
+                pos += 1
+                break
+            try:
+                row, end = self.decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # row is incomplete, wait for more data
+            self.add_row(row)
+            pos = end
+        self.buffer = buffer[pos:]
+
+    def add_row(self, row):
+        if self.columns is None:
+            self.columns = row
+            self.values = [[] for column in row]
+            return
+        for values, value in zip(self.values, row):
+            values.append(value)
+
+    def close(self):
+        self.buffer += self.text_decoder.decode(b'', final=True)
+        self.parse_rows()
+        if not self.finished or self.buffer.strip():
+            raise ValueError("Census payload ended before the closing bracket")
+
+    def get_dataframe(self):
+        if self.columns is None:
+            return pd.DataFrame()
+        df = pd.DataFrame(dict(zip(self.columns, self.values)), columns=self.columns)
+        self.values = None
+        return df
+
+def parse_payload_chunks(chunks):
+    """Parses an iterable of payload byte chunks into a DataFrame of strings."""
+    parser = columnarParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser.get_dataframe()
+
+def iter_bytes(payload, chunk_size=1 << 16):
+    for start in range(0, len(payload), chunk_size):
+        yield payload[start:start + chunk_size]
+
+
+class MyTestCase(unittest.TestCase):
+    data = [['NAME', 'B01001_001E', 'B19013_001E', 'B25077_001E', 'state', 'county'],
+            ['Cook County, Illinois', '5198275', '68428', '-666666666', '17', '031'],
+            ['Lake County, Illinois', '714342', '97127', '265400', '17', '097']]
+
+    def test_estimates_are_numeric(self):
+        df = build_typed_dataframe(self.data, variables=self.data[0][:4])
+        self.assertEqual(np.int32, df['B01001_001E'].dtype)
+        self.assertEqual(5198275, df['B01001_001E'][0])
+        self.assertEqual('Int32', df['B25077_001E'].dtype)
+
+    def test_sentinels_become_na(self):
+        df = build_typed_dataframe(self.data, variables=self.data[0][:4])
+        self.assertTrue(pd.isna(df['B25077_001E'][0]))
+        self.assertEqual(265400, df['B25077_001E'][1])
+
+    def test_geography_columns_are_categorical(self):
+        df = build_typed_dataframe(self.data)
+        self.assertIsInstance(df['county'].dtype, pd.CategoricalDtype)
+        self.assertEqual('Cook County, Illinois', df['NAME'][0])
+
+    def test_streaming_parser_matches_json(self):
+        payload = json.dumps(self.data).replace('],', '],\n').encode('utf-8')
+        df = parse_payload_chunks(iter_bytes(payload, chunk_size=7))
+        self.assertTrue(df.equals(pd.DataFrame(self.data[1:], columns=self.data[0])))
+
+    def test_streaming_parser_rejects_truncated_payload(self):
+        payload = json.dumps(self.data).encode('utf-8')
+        with self.assertRaises(ValueError):
+            parse_payload_chunks([payload[:-20]])
+
+    def test_fractional_int_predicate_stays_float(self):
+        df = build_typed_dataframe([['A', 'B', 'state'], ['5.3', '-666666666', '17'], ['7', '2.5', '18']],
+                                   variables=['A', 'B'], variable_types={'A': 'int', 'B': 'int'})
+        self.assertEqual(np.float32, df['A'].dtype)
+        self.assertAlmostEqual(5.3, df['A'][0], places=5)
+        self.assertTrue(pd.isna(df['B'][0]))
+        self.assertEqual(2.5, df['B'][1])
+
+    def test_controlled_moe_is_zero(self):
+        df = build_typed_dataframe([['B01001_001E', 'B01001_001M', 'B19013_001M', 'state'],
+                                    ['5198275', '-555555555', '-222222222', '17']])
+        self.assertEqual(0, df['B01001_001M'][0])
+        self.assertTrue(pd.isna(df['B19013_001M'][0]))
+
+    def test_predicate_types(self):
+        df = build_typed_dataframe(self.data, variable_types={'B19013_001E': 'float'})
+        self.assertEqual(np.float32, df['B19013_001E'].dtype)
+
+if __name__ == '__main__':
+    unittest.main()
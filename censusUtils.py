@@ -1,14 +1,32 @@
 import os
 import unittest
-import re
 import zipfile
 
 import pandas as pd
-from census import Census
-import us  # Helps convert state names to abbreviations
 from dotenv import load_dotenv
 import geopandas as gpd
-import requests
+from httpUtils import http_get, download_file
+from censusCatalog import get_catalog, parse_discovery_document
+from variableIndex import get_variable_index
+from censusVariables import parse_variables_url, get_variables_dict
+from geocodeBatch import batchGeocoder
+from gazetteer import get_gazetteer
+
+# catalog column -> column name on the data.html table
+CATALOG_TABLE_COLUMNS = {"title": "Title",
+                         "description": "Description",
+                         "year": "Vintage",
+                         "dataset": "Dataset Name",
+                         "type": "Dataset Type",
+                         "documentation": "Developer Documentation",
+                         "api_base_url": "API Base URL"}
+# data.html list column -> link text (the list page name under the dataset's API Base URL)
+CATALOG_LIST_COLUMNS = {"Geography List": "geography",
+                        "Variable List": "variables",
+                        "Group List": "groups",
+                        "Examples": "examples"}
+DATA_HTML_COLUMNS = ["Title", "Description", "Vintage", "Dataset Name", "Dataset Type", *CATALOG_LIST_COLUMNS,
+                     "Developer Documentation", "API Base URL"]
 
 def dataset_html_to_str(html_str):
     dataset_str = html_str.replace('› ', '/')
@@ -18,65 +36,44 @@ def dataset_str_to_html(dataset_str):
     html_str = dataset_str.replace('/', '› ')
     return html_str
 
-def get_census_dict():
-    census_data_url = "https://api.census.gov/data.html"
-    census_table = pd.read_html(census_data_url)
-    census_table = census_table[0][:-1]
+def get_census_table(catalog_table):
+    """Rebuilds the data.html table (columns, 'acs› acs1' dataset names, numeric vintages) from the catalog."""
+    census_table = catalog_table.rename(columns=CATALOG_TABLE_COLUMNS)
+    census_table["Dataset Name"] = census_table["Dataset Name"].map(dataset_str_to_html)
+    census_table["Vintage"] = pd.to_numeric(census_table["Vintage"], errors='coerce')
+    for column, list_name in CATALOG_LIST_COLUMNS.items():
+        census_table[column] = list_name
+    return census_table[DATA_HTML_COLUMNS]
+
+def get_census_dict(refresh=False):
+    census_table = get_census_table(get_catalog(refresh=refresh).table)
     census_dict = census_table.to_dict(orient='index')
     return census_dict
 
 def get_list_url(api_base_url, list_name):
     return f"{api_base_url}/{list_name}.html"
 
-def get_census_dict_by_dataset():
-    census_data_url = "https://api.census.gov/data.html"
-    census_table = pd.read_html(census_data_url)
-    new_columns = {"Title": "title",
-                   "Description": "description",
-                   "Vintage": "year",
-                   "Dataset Name": "dataset",
-                   "Dataset Type": "type",
-                   "Geography List": "geographies_url",
-                   "Variable List": "variables_url",
-                   "Group List": "groups_url",
-                   "Examples": "examples_url",
-                   "Developer Documentation": "documentation",
-                   "API Base URL": "api_base_url"}
-    updated_table = census_table[0].rename(columns=new_columns)
-    headers = list(updated_table.columns.values)
-    census_dict = updated_table[:-1].to_dict(orient='index')
-    new_dict = {}
-    for entry in census_dict:
-        dataset = dataset_html_to_str(census_dict[entry]['dataset'])
-        year = census_dict[entry]['year']
-        if dataset not in new_dict:
-            new_dict[dataset] = {}
-        if year not in new_dict[dataset]:
-            new_dict[dataset][year] = {}
-        for label in headers:
-            if re.search('url', label):
-                new_dict[dataset][year][label] = get_list_url(census_dict[entry]['api_base_url'], census_dict[entry][label])
-            else:
-                new_dict[dataset][year][label] = census_dict[entry][label]
-    return new_dict
+def get_census_dict_by_dataset(refresh=False):
+    """Returns {dataset: {year: entry}} from the locally stored dataset catalog."""
+    return get_catalog(refresh=refresh).get_dict_by_dataset()
 
 def get_dataset_variables(variables_table_url):
+    """Returns {index: variable} for a dataset's variables.html (or variables.json) url."""
+    dataset_year = parse_variables_url(variables_table_url)
+    if dataset_year:
+        return get_variables_dict(*dataset_year)
     variables_table = pd.read_html(variables_table_url)
     variables_dict = variables_table[0].to_dict(orient='index')
     return variables_dict
 def search_variables_by_field(dict, field_name, reg_ex):
-    search_dict = {}
-    for entry in dict.keys():
-        if re.search(reg_ex, str(dict[entry][field_name]), re.IGNORECASE):
-            search_dict[entry] = dict[entry]
-    return search_dict
+    return get_variable_index(dict).search(field_name, reg_ex)
+
+def search_variables_by_keywords(dict, keywords):
+    """Returns the variables whose Label or Concept contain every keyword."""
+    return get_variable_index(dict).search_keywords(keywords)
 
 def get_variable_totals(dict):
-    search_dict = {}
-    for entry in dict.keys():
-        if re.match('Estimate!!Total$', dict[entry]['Label']):
-            search_dict[entry] = dict[entry]
-    return search_dict
+    return get_variable_index(dict).get_totals()
 def search_variables_by_code(dict, name):
     return search_variables_by_name(dict, name)
 def search_variables_by_name(dict, name):
@@ -99,18 +96,12 @@ def get_census_key_from_env(use_test_key=False):
             census_key = os.getenv('CENSUS_KEY')
         return census_key
     else:
-        print(f"WARNING: Can't load file {self.env_file_path}")
+        print("WARNING: Can't load file .env")
         return None
 
 def get_state_geoid(state_name):
-    """Get GEOID for a U.S. state."""
-    c = Census(get_census_key_from_env())
-    state_abbr = us.states.lookup(state_name).abbr
-    data = c.sf1.get(("NAME", "STATE"), {"for": "state:*"})
-    for entry in data:
-        if entry["NAME"] == state_name:
-            return entry["STATE"]
-    return None
+    """Get GEOID for a U.S. state (name, abbreviation or FIPS code) from the local gazetteer."""
+    return get_gazetteer().get_state(state_name)
 def get_geographies(address=None, geography_type=None):
     """
     Fetches geographical information for a given address, city, or state using the U.S. Census Geocoder API.
@@ -127,7 +118,7 @@ def get_geographies(address=None, geography_type=None):
         "address": address
     }
 
-    response = requests.get(base_url, params=params)
+    response = http_get(base_url, params=params)
 
     if response.status_code == 200:
         data = response.json()
@@ -145,12 +136,34 @@ def get_geographies(address=None, geography_type=None):
     else:
         return {"error": f"API request failed with status code {response.status_code}"}
 
+def get_geographies_batch(df, street='street', city='city', state='state', zip_code='zip'):
+    """
+    Geocodes a table of addresses with the batch endpoint, reusing cached results for repeat addresses.
+    :param df: DataFrame with one column per address part
+    :return: DataFrame with the match, coordinates, FIPS codes and block GEOID of every row
+    """
+    geocoder = batchGeocoder()
+    try:
+        return geocoder.geocode(df, street, city, state, zip_code)
+    finally:
+        geocoder.cache.close()
+
 def print_entire_dict_or_table(dict):
     for entry in dict:
         print_dict_entry(dict[entry])
 
 class MyTestCase(unittest.TestCase):
 
+    def test_census_table_matches_data_html(self):
+        catalog_table = parse_discovery_document({'dataset': [
+            {'c_vintage': 2005, 'c_dataset': ['acs', 'acs1'], 'title': 'ACS 1-Year Detailed Tables',
+             'distribution': [{'accessURL': 'http://api.census.gov/data/2005/acs/acs1'}]}]})
+        entry = get_census_table(catalog_table).to_dict(orient='index')[0]
+        self.assertEqual(DATA_HTML_COLUMNS, list(entry))
+        self.assertEqual('acs› acs1', entry['Dataset Name'])
+        self.assertEqual(2005, entry['Vintage'])
+        self.assertEqual('variables', entry['Variable List'])
+
     def test_something(self):
         census_dict = get_census_dict_by_dataset()
         self.assertEqual(True, True)  # add assertion here
@@ -163,14 +176,8 @@ def download_and_extract_tiger(url, save_path, extract_to):
     """Downloads and extracts a TIGER/Line shapefile from the Census Bureau."""
     if not os.path.exists(save_path):
         print(f"Downloading {url}...")
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            with open(save_path, "wb") as file:
-                for chunk in response.iter_content(1024):
-                    file.write(chunk)
-            print("Download complete.")
-        else:
-            raise Exception(f"Failed to download: {response.status_code}")
+        download_file(url, save_path)
+        print("Download complete.")
 
     # Extract the ZIP file
     print("Extracting files...")
@@ -0,0 +1,179 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from censusCache import DEFAULT_CACHE_DIR
+from httpUtils import http_get
+
+CENSUS_DATA_URL = 'https://api.census.gov/data'
+NO_VINTAGE = ('', None, 'N/A')
+
+# Same columns as the variables.html table so existing dict consumers keep working
+VARIABLE_COLUMNS = ['Name', 'Label', 'Concept', 'Required', 'Attributes', 'Limit', 'Predicate Type', 'Group']
+
+VARIABLES_URL_PATTERN = re.compile(r'/data/(?:(\d{4})/)?(.+?)/variables\.(?:html|json)$')
+# ACS estimate / margin of error names, e.g. B01001_001E / B01001_001M, DP02_0001PE / DP02_0001PM
+ESTIMATE_PATTERN = re.compile(r'^([A-Z]+\d+\w*_\d{3,4}P?)E$')
+MOE_PATTERN = re.compile(r'^[A-Z]+\d+\w*_\d{3,4}P?M$')
+
+variable_tables = {}
+variable_dicts = {}
+
+
+def get_variables_url(dataset, year=None):
+    if year in NO_VINTAGE:
+        return f"{CENSUS_DATA_URL}/{dataset}/variables.json"
+    return f"{CENSUS_DATA_URL}/{year}/{dataset}/variables.json"
+
+def parse_variables_url(variables_url):
+    """Returns (dataset, year) for a variables.html / variables.json url, or None."""
+    match = VARIABLES_URL_PATTERN.search(variables_url)
+    if not match:
+        return None
+    return match.group(2), match.group(1) or ''
+
+def get_moe_variable(variable):
+    """Returns the margin of error variable of an ACS estimate, or None for other variables."""
+    match = ESTIMATE_PATTERN.match(variable)
+    return f"{match.group(1)}M" if match else None
+
+def is_moe_variable(variable):
+    return bool(MOE_PATTERN.match(variable))
+
+def add_moe_variables(variables):
+    """Returns the variables with each estimate's margin of error right after it (if not already requested)."""
+    result = []
+    for variable in variables:
+        if variable not in result:
+            result.append(variable)
+        moe = get_moe_variable(variable)
+        if moe and moe not in variables and moe not in result:
+            result.append(moe)
+    return result
+
+def get_variables_path(dataset, year, cache_dir=DEFAULT_CACHE_DIR):
+    vintage = 'timeseries' if year in NO_VINTAGE else str(year)
+    return os.path.join(cache_dir, 'variables', dataset.replace('/', '_'), f"{vintage}.parquet")
+
+def parse_variables_document(document):
+    rows = []
+    for name, entry in document.get('variables', {}).items():
+        rows.append({'Name': name,
+                     'Label': entry.get('label', ''),
+                     'Concept': entry.get('concept'),
+                     'Required': str(entry.get('required', '')),
+                     'Attributes': entry.get('attributes', ''),
+                     'Limit': int(entry.get('limit', 0) or 0),
+                     'Predicate Type': entry.get('predicateType', ''),
+                     'Group': entry.get('group', 'N/A')})
+    return pd.DataFrame(rows, columns=VARIABLE_COLUMNS).sort_values('Name', ignore_index=True)
+
+def fetch_variables_document(dataset, year=None):
+    response = http_get(get_variables_url(dataset, year))
+    response.raise_for_status()
+    return response.json()
+
+def load_dataset_variables(dataset, year=None, cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    """
+    Loads the variables of a dataset vintage from variables.json, storing them as parquet so
+    later calls (in this or any other process) skip the download.
+
+    :return: (DataFrame) One row per variable with the VARIABLE_COLUMNS
+    """
+    key = (dataset, str(year or ''))
+    if not refresh and key in variable_tables:
+        return variable_tables[key]
+    path = get_variables_path(dataset, year, cache_dir)
+    if not refresh and os.path.exists(path):
+        table = pd.read_parquet(path)
+    else:
+        table = parse_variables_document(fetch_variables_document(dataset, year))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    variable_tables[key] = table
+    variable_dicts.pop(key, None)
+    return table
+
+def get_variables_dict(dataset, year=None, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the variables as {index: row} like the read_html table did, reusing the same dict per vintage."""
+    key = (dataset, str(year or ''))
+    if key not in variable_dicts:
+        variable_dicts[key] = load_dataset_variables(dataset, year, cache_dir).to_dict(orient='index')
+    return variable_dicts[key]
+
+def get_variables_key(variables_dict):
+    """Returns the (dataset, year) key of a dict returned by get_variables_dict, or None for any other dict."""
+    for key, loaded in variable_dicts.items():
+        if loaded is variables_dict:
+            return key
+    return None
+
+def get_variable_types(dataset, year, variables=None, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns {variable: predicateType} for the given variables (or all of them)."""
+    table = load_dataset_variables(dataset, year, cache_dir)
+    if variables is not None:
+        table = table[table['Name'].isin(variables)]
+    return dict(zip(table['Name'], table['Predicate Type']))
+
+def get_group_variables(dataset, year, group, cache_dir=DEFAULT_CACHE_DIR):
+    table = load_dataset_variables(dataset, year, cache_dir)
+    return table[table['Group'] == group]
+
+def get_variable_attributes(dataset, year, variable, cache_dir=DEFAULT_CACHE_DIR):
+    """Returns the attribute variables (margins of error, annotations) linked to a variable."""
+    table = load_dataset_variables(dataset, year, cache_dir)
+    attributes = table.loc[table['Name'] == variable, 'Attributes']
+    if attributes.empty or not attributes.iloc[0]:
+        return []
+    return attributes.iloc[0].split(',')
+
+
+class MyTestCase(unittest.TestCase):
+    document = {'variables': {
+        'for': {'label': "Census API FIPS 'for' clause", 'concept': 'Census API Geography Specification',
+                'predicateType': 'fips-for', 'group': 'N/A', 'limit': 0, 'predicateOnly': True},
+        'B01001_001E': {'label': 'Estimate!!Total', 'concept': 'SEX BY AGE', 'predicateType': 'int',
+                        'group': 'B01001', 'limit': 0, 'attributes': 'B01001_001M,B01001_001EA'},
+        'B19013_001E': {'label': 'Estimate!!Median household income', 'concept': 'MEDIAN HOUSEHOLD INCOME',
+                        'predicateType': 'int', 'group': 'B19013', 'limit': 0}}}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        path = get_variables_path('acs/acs1', '2005', self.cache_dir)
+        os.makedirs(os.path.dirname(path))
+        parse_variables_document(self.document).to_parquet(path, index=False)
+        variable_tables.clear()
+        variable_dicts.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        variable_tables.clear()
+        variable_dicts.clear()
+
+    def test_parse_variables_url(self):
+        self.assertEqual(('acs/acs1', '2005'), parse_variables_url('http://api.census.gov/data/2005/acs/acs1/variables.html'))
+        self.assertEqual(('timeseries/eits/resconst', ''), parse_variables_url('https://api.census.gov/data/timeseries/eits/resconst/variables.json'))
+
+    def test_moe_variables(self):
+        self.assertEqual('DP02_0001PM', get_moe_variable('DP02_0001PE'))
+        self.assertIsNone(get_moe_variable('NAME'))
+        self.assertEqual(['NAME', 'B01001_001E', 'B01001_001M', 'B19013_001E', 'B19013_001M'],
+                         add_moe_variables(['NAME', 'B01001_001E', 'B19013_001E', 'B19013_001M']))
+
+    def test_metadata_from_stored_table(self):
+        self.assertEqual({'B01001_001E': 'int'}, get_variable_types('acs/acs1', '2005', ['B01001_001E'], self.cache_dir))
+        self.assertEqual(['B01001_001M', 'B01001_001EA'], get_variable_attributes('acs/acs1', '2005', 'B01001_001E', self.cache_dir))
+        self.assertEqual(['B19013_001E'], list(get_group_variables('acs/acs1', '2005', 'B19013', self.cache_dir)['Name']))
+
+    def test_variables_dict_is_reused(self):
+        variables = get_variables_dict('acs/acs1', '2005', self.cache_dir)
+        self.assertIs(variables, get_variables_dict('acs/acs1', '2005', self.cache_dir))
+        self.assertEqual('Estimate!!Total', variables[0]['Label'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 
-import requests
+from httpUtils import http_get, download_file
+import os
+import shutil
+import tempfile
 import unittest
 import geopandas as gpd
 import matplotlib.pyplot as plt
@@ -12,7 +15,7 @@ def list_datasets(limit=None):
     else:
         params = {}
 
-    response = requests.get(url, params=params)
+    response = http_get(url, params=params)
     response.raise_for_status()
 
     datasets = response.json().get("results", [])
@@ -31,7 +34,7 @@ def search_datasets(query, limit=None):
     else:
         params = {"q": query}
 
-    response = requests.get(url, params=params)
+    response = http_get(url, params=params)
     response.raise_for_status()
 
     results = response.json().get("results", [])
@@ -46,7 +49,7 @@ def get_dataset_metadata(dataset_id):
     """Fetch metadata for a specific dataset."""
     url = f"https://data.cityofchicago.org/api/views/metadata/v1/{dataset_id}"
 
-    response = requests.get(url)
+    response = http_get(url)
     response.raise_for_status()
 
     return response.json()
@@ -65,14 +68,53 @@ def list_columns(dataset_id):
 
 #    # Example: Check columns in the Crime dataset
 #    list_columns("ijzp-q8t2")
-import requests
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from asyncUtils import run_bounded
+from soqlQuery import soqlQuery, aggregate, date_trunc
+
+
+# Socrata column type -> pandas dtype used when parsing CSV exports; every other type
+# (text, url, email, phone, location, geometries, ...) is read as text so the schema never depends on a chunk
+EXPORT_DTYPES = {"number": "float64",
+                 "money": "float64",
+                 "percent": "float64",
+                 "double": "float64",
+                 "checkbox": "boolean"}
+EXPORT_DEFAULT_DTYPE = "string"
+EXPORT_DATE_TYPES = ("calendar_date", "date", "floating_timestamp", "fixed_timestamp")
+EXPORT_DATE_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+EXPORT_CHUNK_SIZE = 100000
+
+def get_export_dtypes(metadata):
+    """Returns ({column name: dtype}, [date columns]) for a dataset's CSV export from its metadata."""
+    dtypes = {}
+    date_columns = []
+    for column in metadata.get("columns", []):
+        data_type = column.get("dataTypeName", "").lower()
+        if data_type in EXPORT_DATE_TYPES:
+            dtypes[column["name"]] = "string"
+            date_columns.append(column["name"])
+        else:
+            dtypes[column["name"]] = EXPORT_DTYPES.get(data_type, EXPORT_DEFAULT_DTYPE)
+    return dtypes, date_columns
 
+def parse_export_dates(values):
+    try:
+        return pd.to_datetime(values, format=EXPORT_DATE_FORMAT)
+    except ValueError:
+        return pd.to_datetime(values, format="mixed")
 
 class chicagoData:
     BASE_URL = "https://data.cityofchicago.org/resource"
+    EXPORT_URL = "https://data.cityofchicago.org/api/views"
+    PAGE_SIZE = 50000
+    MAX_WORKERS = 4
 
-    def __init__(self, dataset_id, fields=None, filters=None, order_by=None, limit=1000, app_token=None):
+    def __init__(self, dataset_id, fields=None, filters=None, order_by=None, limit=1000, app_token=None, query=None):
         """
         Initialize the API wrapper for the Chicago Data Portal.
 
@@ -82,6 +124,8 @@ class chicagoData:
         :param order_by: (str) Column to sort by
         :param limit: (int) Number of results to fetch (default: 1000)
         :param app_token: (str) Optional Socrata app token for higher request limits
+        :param query: (soqlQuery) Optional query ($where, $group, aggregates, $having) run on the portal,
+            its clauses take precedence over fields and order_by
         """
         self.dataset_id = dataset_id
         self.fields = fields
@@ -89,6 +133,8 @@ class chicagoData:
         self.order_by = order_by
         self.limit = limit
         self.app_token = app_token
+        self.query = query
+        self.query_checked = False
 
     def get_url(self):
         """Constructs the API URL."""
@@ -114,18 +160,39 @@ class chicagoData:
         # Limit number of results
         params["$limit"] = self.limit
 
+        # Query builder clauses
+        if self.query:
+            params.update(self.query.get_params())
+
         # Add App Token if provided
         if self.app_token:
             params["$$app_token"] = self.app_token
 
         return params
 
+    def is_grouped(self):
+        return bool(self.query and self.query.groups)
+
+    def is_single_row(self):
+        """Aggregates without a group return one row that has no :id to page on."""
+        return bool(self.query and not self.query.groups and self.query.is_aggregate())
+
+    def get_query_limit(self):
+        return self.query.limit_value if self.query else None
+
+    def check_query(self):
+        """Validates the query's fields against the dataset metadata once, before the first request."""
+        if self.query and not self.query_checked:
+            self.query.validate(self.get_metadata())
+            self.query_checked = True
+
     def get_data(self):
         """Fetches data from the Chicago Data Portal API."""
+        self.check_query()
         url = self.get_url()
         params = self.get_params()
 
-        response = requests.get(url, params=params)
+        response = http_get(url, params=params)
 
         if response.status_code == 200:
             data = response.json()
@@ -134,14 +201,240 @@ class chicagoData:
             print(f"Error: {response.status_code} - {response.text}")
             return None
 
+    def get_count_params(self):
+        """Query parameters for counting the rows matched by the filters."""
+        params = {key: value for key, value in self.get_params().items() if key not in ("$select", "$order", "$limit", "$offset", "$group", "$having")}
+        params["$select"] = "count(*) AS count"
+        return params
+
+    def get_row_count(self):
+        """Returns the number of rows matched by the filters."""
+        response = http_get(self.get_url(), params=self.get_count_params())
+        response.raise_for_status()
+        return int(response.json()[0]["count"])
+
+    def get_page_order(self):
+        """Pages need a total order, so the row id breaks ties in the requested sort."""
+        if self.is_grouped():
+            # Grouped rows have no :id, the group keys are unique per row
+            order = self.query.orders + [expression for expression in self.query.groups if expression not in self.query.orders]
+            return ", ".join(order)
+        if self.query and self.query.orders:
+            return f"{', '.join(self.query.orders)}, :id"
+        if not self.order_by:
+            return ":id"
+        if ":id" in self.order_by:
+            return self.order_by
+        return f"{self.order_by}, :id"
+
+    def get_page_params(self, offset, page_size):
+        params = self.get_params()
+        params["$order"] = self.get_page_order()
+        params["$limit"] = page_size
+        params["$offset"] = offset
+        return params
+
+    def get_page(self, offset, page_size):
+        response = http_get(self.get_url(), params=self.get_page_params(offset, page_size))
+        response.raise_for_status()
+        return pd.DataFrame(response.json())
+
+    def get_single_row(self):
+        response = http_get(self.get_url(), params=self.get_params())
+        response.raise_for_status()
+        return pd.DataFrame(response.json())
+
+    def iter_pages(self, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+        """
+        Yields every row matched by the filters as DataFrame pages, in order.
+
+        The row count is fetched first and the $offset pages are requested
+        concurrently, with at most max_workers pages held in memory at a time.
+        Grouped queries cannot be counted up front, so their pages are
+        requested one after another until a short page comes back.
+        Ungrouped aggregates are a single request, and a query limit() caps
+        the number of rows returned.
+        """
+        self.check_query()
+        if self.is_single_row():
+            yield self.get_single_row()
+            return
+        limit = self.get_query_limit()
+        if self.is_grouped():
+            offset = 0
+            while limit is None or offset < limit:
+                size = page_size if limit is None else min(page_size, limit - offset)
+                page = self.get_page(offset, size)
+                yield page
+                if len(page) < size:
+                    return
+                offset += size
+            return
+        total = self.get_row_count()
+        if limit is not None:
+            total = min(total, limit)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for offset in range(0, total, page_size):
+                pending.append(executor.submit(self.get_page, offset, min(page_size, total - offset)))
+                if len(pending) >= max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def get_all_data(self, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+        """Fetches every row matched by the filters, ignoring the limit (a query limit() still applies)."""
+        pages = list(self.iter_pages(page_size, max_workers))
+        if not pages:
+            return pd.DataFrame()
+        return pd.concat(pages, ignore_index=True)
+
+    def get_export_url(self):
+        """Constructs the bulk CSV export URL (the whole dataset, filters are not applied)."""
+        return f"{self.EXPORT_URL}/{self.dataset_id}/rows.csv?accessType=DOWNLOAD"
+
+    def get_metadata(self):
+        if getattr(self, "metadata", None) is None:
+            self.metadata = get_dataset_metadata(self.dataset_id)
+        return self.metadata
+
+    def download_export(self, csv_path):
+        """Streams the CSV export straight to disk."""
+        print(f"Downloading {self.get_export_url()}...")
+        return download_file(self.get_export_url(), csv_path)
+
+    def iter_export_chunks(self, csv_path, chunksize=EXPORT_CHUNK_SIZE):
+        """Parses a downloaded CSV export in chunks, with dtypes taken from the dataset's column types."""
+        dtypes, date_columns = get_export_dtypes(self.get_metadata())
+        for chunk in pd.read_csv(csv_path, dtype=dtypes, chunksize=chunksize):
+            for column in date_columns:
+                if column in chunk.columns:
+                    chunk[column] = parse_export_dates(chunk[column])
+            yield chunk
+
+    def export_to_parquet(self, csv_path, parquet_path, chunksize=EXPORT_CHUNK_SIZE):
+        """Converts a downloaded CSV export to parquet one chunk at a time."""
+        writer = None
+        rows = 0
+        try:
+            for chunk in self.iter_export_chunks(csv_path, chunksize):
+                table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(f"{parquet_path}.tmp", table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            os.replace(f"{parquet_path}.tmp", parquet_path)
+        return rows
+
+    def export(self, csv_path, parquet_path=None, chunksize=EXPORT_CHUNK_SIZE):
+        """
+        Downloads the full dataset through the CSV export, optionally converting it to parquet.
+
+        :param csv_path: (str) Where the CSV export is written
+        :param parquet_path: (str) Optional parquet file written chunk by chunk from the CSV
+        :return: (str) The parquet path if one was given, otherwise the CSV path
+        """
+        self.download_export(csv_path)
+        if parquet_path:
+            self.export_to_parquet(csv_path, parquet_path, chunksize)
+            return parquet_path
+        return csv_path
+
+    async def get_data_async(self, semaphore=None):
+        """Async variant of get_data, holding the semaphore (if given) while the request is in flight."""
+        return await run_bounded(self.get_data, semaphore=semaphore)
+
 
 class MyTestCase(unittest.TestCase):
-    crime_api = ChicagoDataAPI("ijzp-q8t2")  # Crime dataset
-    data = crime_api.get_data(limit=5, filters={"primary_type": "THEFT"}, order_by="date")
-    print(data)
 
     def test_something(self):
         self.assertEqual(True, True)  # add assertion here
+
+    def test_iter_pages(self):
+        class fakeChicagoData(chicagoData):
+            def get_row_count(self):
+                return 25
+
+            def get_page(self, offset, page_size):
+                return pd.DataFrame({"id": range(offset, min(offset + page_size, 25))})
+
+        crimes = fakeChicagoData("ijzp-q8t2", filters={"primary_type": "THEFT"}, order_by="date")
+        pages = list(crimes.iter_pages(page_size=10, max_workers=2))
+        self.assertEqual([10, 10, 5], [len(page) for page in pages])
+        self.assertEqual(list(range(25)), list(crimes.get_all_data(page_size=10)["id"]))
+        self.assertEqual({"primary_type": "THEFT", "$select": "count(*) AS count"}, crimes.get_count_params())
+        params = crimes.get_page_params(20, 10)
+        self.assertEqual(("date, :id", 10, 20), (params["$order"], params["$limit"], params["$offset"]))
+        crimes.query = soqlQuery().limit(15)
+        crimes.query_checked = True
+        self.assertEqual([10, 5], [len(page) for page in crimes.iter_pages(page_size=10)])
+
+    def test_ungrouped_aggregate(self):
+        requests = []
+
+        class fakeChicagoData(chicagoData):
+            def get_row_count(self):
+                raise AssertionError("an ungrouped aggregate is not counted")
+
+            def get_single_row(self):
+                requests.append(self.get_params())
+                return pd.DataFrame({"total": [42]})
+
+        crimes = fakeChicagoData("ijzp-q8t2", query=soqlQuery().select(aggregate("sum", "x", alias="total")))
+        crimes.query_checked = True
+        self.assertEqual([42], list(crimes.get_all_data()["total"]))
+        self.assertEqual(1, len(requests))
+        self.assertEqual("sum(x) AS total", requests[0]["$select"])
+        self.assertNotIn("$order", requests[0])
+
+    def test_export_chunks(self):
+        export_dir = tempfile.mkdtemp()
+        csv_path = os.path.join(export_dir, "rows.csv")
+        with open(csv_path, "w") as file:
+            file.write("ID,Date,Arrest,Ward,Location,Email\n"
+                       "1,01/02/2024 03:04:05 PM,true,42,\"(41.8, -87.6)\",\n"
+                       "2,01/03/2024 11:00:00 AM,false,,,\n"
+                       "3,01/04/2024 12:30:00 AM,false,7,,a@b.com\n")
+        wards = chicagoData("ijzp-q8t2")
+        wards.metadata = {"columns": [{"name": "ID", "dataTypeName": "number"},
+                                      {"name": "Date", "dataTypeName": "calendar_date"},
+                                      {"name": "Arrest", "dataTypeName": "checkbox"},
+                                      {"name": "Ward", "dataTypeName": "number"},
+                                      {"name": "Location", "dataTypeName": "location"},
+                                      {"name": "Email", "dataTypeName": "email"}]}
+        chunks = list(wards.iter_export_chunks(csv_path, chunksize=2))
+        self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual("float64", chunks[0]["Ward"].dtype)
+        self.assertEqual("boolean", chunks[0]["Arrest"].dtype)
+        self.assertEqual(pd.Timestamp("2024-01-02 15:04:05"), chunks[0]["Date"][0])
+        parquet_path = os.path.join(export_dir, "rows.parquet")
+        self.assertEqual(3, wards.export_to_parquet(csv_path, parquet_path, chunksize=2))
+        self.assertEqual("string", chunks[1]["Email"].dtype)
+        self.assertEqual([42.0, 7.0], pd.read_parquet(parquet_path)["Ward"].dropna().tolist())
+        self.assertEqual(["a@b.com"], pd.read_parquet(parquet_path)["Email"].dropna().tolist())
+        shutil.rmtree(export_dir)
+
+    def test_query_params(self):
+        query = (soqlQuery().select("ward", date_trunc("date", alias="month"), aggregate("count", alias="crimes"))
+                 .where_equals("primary_type", "THEFT").group("ward", date_trunc("date")))
+        crimes = chicagoData("ijzp-q8t2", query=query)
+        crimes.metadata = {"columns": [{"fieldName": "ward"}, {"fieldName": "date"}, {"fieldName": "primary_type"}]}
+        params = crimes.get_page_params(0, 1000)
+        self.assertEqual("ward, date_trunc_ym(date) AS month, count(*) AS crimes", params["$select"])
+        self.assertEqual("primary_type = 'THEFT'", params["$where"])
+        self.assertEqual("ward, date_trunc_ym(date)", params["$order"])
+        crimes.check_query()
+        with self.assertRaises(ValueError):
+            query.validate({"columns": [{"fieldName": "ward"}]})
+
+    def test_crime_data(self):
+        crime_api = chicagoData("ijzp-q8t2", filters={"primary_type": "THEFT"}, order_by="date", limit=5)  # Crime dataset
+        data = crime_api.get_data()
+        print(data)
     def test_ward_population(self):
         # Ward Population Dataset ID from the portal
         dataset_id = "k5pk-wpt9"
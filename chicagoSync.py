@@ -0,0 +1,231 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+
+import pandas as pd
+
+from censusCache import DEFAULT_CACHE_DIR
+from chicagoData import chicagoData
+from soqlQuery import quote
+
+DEFAULT_STORE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'chicago')
+DEFAULT_PARTITIONS = 16
+ID_FIELD = ':id'
+UPDATED_FIELD = ':updated_at'
+
+
+def normalize_page(page):
+    """Stores nested values (locations, points) as JSON text so every delta file has a flat schema."""
+    page = page.copy()
+    for column in page.columns:
+        if page[column].dtype == object and page[column].map(lambda value: isinstance(value, (dict, list))).any():
+            page[column] = page[column].map(lambda value: json.dumps(value) if isinstance(value, (dict, list)) else value)
+    return page
+
+def read_parquet_files(paths):
+    frames = [pd.read_parquet(path) for path in paths]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def latest_rows(frame):
+    """Keeps the most recently updated version of every row id."""
+    if frame.empty:
+        return frame
+    frame = frame.sort_values(UPDATED_FIELD, kind='stable')
+    return frame.drop_duplicates(ID_FIELD, keep='last').sort_values(ID_FIELD, ignore_index=True)
+
+
+class chicagoSync():
+    """
+    Incrementally mirrors a Chicago Data Portal dataset into a local parquet store.
+
+    Each sync only requests rows after the stored (:updated_at, :id) key and
+    appends them as delta files to hash partitions of :id.
+    Reads keep the latest version of each row; compact() folds the deltas
+    into one base file per partition.
+    """
+
+    def __init__(self, dataset_id, store_dir=DEFAULT_STORE_DIR, partitions=DEFAULT_PARTITIONS, app_token=None):
+        """
+        :param dataset_id: (str) Dataset ID from the Chicago Data Portal (e.g., 'ijzp-q8t2' for crimes)
+        :param store_dir: (str) Directory holding one sub directory per dataset
+        :param partitions: (int) Number of :id hash partitions
+        :param app_token: (str) Optional Socrata app token for higher request limits
+        """
+        self.dataset_id = dataset_id
+        self.path = os.path.join(store_dir, dataset_id)
+        self.partitions = partitions
+        self.app_token = app_token
+
+    def get_state_path(self):
+        return os.path.join(self.path, 'state.json')
+
+    def get_partition_path(self, partition):
+        return os.path.join(self.path, f"part={partition:03d}")
+
+    def get_state(self):
+        if not os.path.exists(self.get_state_path()):
+            return {}
+        with open(self.get_state_path()) as file:
+            return json.load(file)
+
+    def get_watermark(self):
+        return self.get_state().get('watermark')
+
+    def get_last_id(self):
+        return self.get_state().get('last_id') or ''
+
+    def set_watermark(self, watermark, last_id=''):
+        os.makedirs(self.path, exist_ok=True)
+        with open(f"{self.get_state_path()}.tmp", 'w') as file:
+            json.dump({'watermark': watermark, 'last_id': last_id, 'synced_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, file)
+        os.replace(f"{self.get_state_path()}.tmp", self.get_state_path())
+
+    def get_query(self, watermark=None, last_id=''):
+        """Rows after the (:updated_at, :id) key of the last stored row, in key order."""
+        filters = None
+        if watermark:
+            filters = {'$where': f"{UPDATED_FIELD} > {quote(watermark)} OR "
+                                 f"({UPDATED_FIELD} = {quote(watermark)} AND {ID_FIELD} > {quote(last_id)})"}
+        return chicagoData(self.dataset_id, fields=[':*', '*'], filters=filters, order_by=f"{UPDATED_FIELD}, {ID_FIELD}", app_token=self.app_token)
+
+    def get_page(self, watermark, last_id, page_size):
+        return self.get_query(watermark, last_id).get_page(0, page_size)
+
+    def get_partitions(self, page):
+        return pd.util.hash_pandas_object(page[ID_FIELD], index=False).to_numpy() % self.partitions
+
+    def upsert(self, page):
+        """Appends the page's rows as delta files in their :id partitions."""
+        page = normalize_page(page)
+        name = f"delta-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+        for partition, rows in page.groupby(self.get_partitions(page)):
+            partition_path = self.get_partition_path(partition)
+            os.makedirs(partition_path, exist_ok=True)
+            rows.to_parquet(os.path.join(partition_path, f"{name}.tmp"), index=False)
+            os.replace(os.path.join(partition_path, f"{name}.tmp"), os.path.join(partition_path, name))
+
+    def sync(self, page_size=chicagoData.PAGE_SIZE):
+        """
+        Fetches the rows changed since the last sync and upserts them.
+
+        Pages are requested one after another with keyset pagination on
+        (:updated_at, :id) rather than $offset, so rows updated while the
+        sync runs move behind the key and are picked up by a later page
+        instead of shifting other rows into pages already fetched. The key
+        is stored after every page, so an interrupted sync resumes.
+
+        :return: (int) Number of rows fetched
+        """
+        watermark = self.get_watermark()
+        last_id = self.get_last_id()
+        rows = 0
+        while True:
+            page = self.get_page(watermark, last_id, page_size)
+            if page.empty:
+                break
+            self.upsert(page)
+            rows += len(page)
+            watermark = page[UPDATED_FIELD].iloc[-1]
+            last_id = page[ID_FIELD].iloc[-1]
+            self.set_watermark(watermark, last_id)
+            if len(page) < page_size:
+                break
+        return rows
+
+    def get_files(self, partition=None):
+        pattern = self.get_partition_path(partition) if partition is not None else os.path.join(self.path, 'part=*')
+        return sorted(glob.glob(os.path.join(pattern, '*.parquet')))
+
+    def load(self, columns=None):
+        """Returns the current state of the dataset (latest version of every row)."""
+        frame = latest_rows(read_parquet_files(self.get_files()))
+        return frame if columns is None else frame[columns]
+
+    def compact(self):
+        """Rewrites each partition as a single base file without superseded row versions."""
+        for partition in range(self.partitions):
+            paths = self.get_files(partition)
+            if len(paths) <= 1:
+                continue
+            base_path = os.path.join(self.get_partition_path(partition), 'base.parquet')
+            latest_rows(read_parquet_files(paths)).to_parquet(f"{base_path}.tmp", index=False)
+            os.replace(f"{base_path}.tmp", base_path)
+            for path in paths:
+                if path != base_path:
+                    os.remove(path)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.source = pd.DataFrame(columns=[':id', ':updated_at', 'ward'])
+        self.keys = []
+        test = self
+
+        class offlineSync(chicagoSync):
+            def get_page(self, watermark, last_id, page_size):
+                # Serves the source like the portal would for the keyset query
+                test.keys.append((watermark, last_id))
+                source = test.source.sort_values([UPDATED_FIELD, ID_FIELD], ignore_index=True)
+                if watermark:
+                    after = (source[UPDATED_FIELD] > watermark) | ((source[UPDATED_FIELD] == watermark) & (source[ID_FIELD] > last_id))
+                    source = source[after]
+                page = source.head(page_size).reset_index(drop=True)
+                test.on_page()
+                return page
+        self.on_page = lambda: None
+        self.sync = offlineSync('ijzp-q8t2', self.store_dir, partitions=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    def add_rows(self, ids, updated_at, ward=None):
+        rows = pd.DataFrame({':id': ids, ':updated_at': updated_at, 'ward': ward or [None] * len(ids)})
+        self.source = pd.concat([self.source[~self.source[':id'].isin(ids)], rows], ignore_index=True)
+
+    def test_incremental_sync(self):
+        self.add_rows(['row-1', 'row-2'], ['2024-01-01T00:00:00.000Z', '2024-01-02T00:00:00.000Z'], ['1', '2'])
+        self.assertEqual(2, self.sync.sync())
+        self.add_rows(['row-2', 'row-3'], ['2024-01-05T00:00:00.000Z'] * 2, ['22', '3'])
+        self.assertEqual(2, self.sync.sync())
+        self.assertEqual(('2024-01-02T00:00:00.000Z', 'row-2'), self.keys[1])
+        self.assertEqual('2024-01-05T00:00:00.000Z', self.sync.get_watermark())
+        self.assertEqual('row-3', self.sync.get_last_id())
+        frame = self.sync.load()
+        self.assertEqual(['row-1', 'row-2', 'row-3'], list(frame[':id']))
+        self.assertEqual(['1', '22', '3'], list(frame['ward']))
+
+    def test_rows_updated_during_sync(self):
+        self.add_rows([f"row-{i}" for i in range(6)], ['2024-01-01T00:00:00.000Z'] * 6, [str(i) for i in range(6)])
+        updates = iter([lambda: self.add_rows(['row-0'], ['2024-01-09T00:00:00.000Z'], ['updated'])])
+
+        def update_once():
+            for update in updates:
+                update()
+                break
+        self.on_page = update_once
+        self.assertEqual(7, self.sync.sync(page_size=2))
+        frame = self.sync.load()
+        self.assertEqual([f"row-{i}" for i in range(6)], list(frame[':id']))
+        self.assertEqual('updated', frame['ward'][0])
+
+    def test_compact(self):
+        self.add_rows([f"row-{i:02d}" for i in range(20)], ['2024-01-01T00:00:00.000Z'] * 20)
+        self.sync.sync()
+        self.add_rows([f"row-{i:02d}" for i in range(10)], ['2024-02-01T00:00:00.000Z'] * 10)
+        self.sync.sync()
+        before = self.sync.load()
+        self.sync.compact()
+        self.assertTrue(all(path.endswith('base.parquet') for path in self.sync.get_files()))
+        self.assertTrue(before.equals(self.sync.load()))
+
+if __name__ == '__main__':
+    unittest.main()
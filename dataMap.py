@@ -1,11 +1,11 @@
-import geopandas as gpd
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
+from tigerCache import tigerCache
 
-# Load the US counties shapefile from an online source or local file
-url = "https://www2.census.gov/geo/tiger/TIGER2022/COUNTY/tl_2022_us_county.zip"
-counties = gpd.read_file(url)
+tiger = tigerCache()
+
+# Load the US counties layer (downloaded once, then read from the local TIGER cache)
+counties = tiger.load(2022, 'county')
 
 # Plot the counties
 fig, ax = plt.subplots(figsize=(12, 8))
@@ -20,7 +20,7 @@ plt.show()
 # Select counties for a specific state (e.g., Texas FIPS code = '48')
 # state_fips = ['48', '06']  # Texas (48) and California (06)
 state_fips = ['48']  # List of FIPS codes for desired states
-counties_filtered = counties[counties['STATEFP'].isin(state_fips)]
+counties_filtered = tiger.load(2022, 'county', filters={'STATEFP': state_fips})
 
 # Plot counties for selected state(s)
 fig, ax = plt.subplots(figsize=(8, 6))
@@ -31,9 +31,8 @@ ax.axis("off")
 
 plt.show()
 
-# Load the MSAs shapefile
-msa_url = "https://www2.census.gov/geo/tiger/TIGER2022/METRO/tl_2022_us_cbsa.zip"
-msas = gpd.read_file(msa_url)
+# Load the MSAs layer
+msas = tiger.load(2022, 'cbsa')
 
 # Plot MSAs
 fig, ax = plt.subplots(figsize=(12, 8))
@@ -46,7 +45,7 @@ plt.show()
 
 
 msa_name = "Dallas-Fort Worth-Arlington, TX"
-msa_filtered = msas[msas['NAME'] == msa_name]
+msa_filtered = tiger.load(2022, 'cbsa', filters={'NAME': msa_name})
 
 fig, ax = plt.subplots(figsize=(8, 6))
 msa_filtered.plot(ax=ax, edgecolor="black", facecolor="lightblue", linewidth=0.5)
@@ -57,12 +56,8 @@ ax.axis("off")
 plt.show()
 
 
-# Load US counties shapefile
-url = "https://www2.census.gov/geo/tiger/TIGER2022/COUNTY/tl_2022_us_county.zip"
-counties = gpd.read_file(url)
-
-# Filter for Texas (FIPS = '48')
-texas_counties = counties[counties['STATEFP'] == '48']
+# Load only the Texas counties (FIPS = '48')
+texas_counties = tiger.load(2022, 'county', filters={'STATEFP': '48'})
 
 # Generate synthetic population data (Replace this with real census data)
 np.random.seed(42)
@@ -0,0 +1,214 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+import us
+
+from censusCache import DEFAULT_CACHE_DIR
+from geoidUtils import get_level
+from httpUtils import download_file
+from tigerCache import tigerCache
+
+GAZETTEER_URL = 'https://www2.census.gov/geo/docs/maps-data/data/gazetteer'
+DEFAULT_GAZETTEER_DIR = os.path.join(DEFAULT_CACHE_DIR, 'gazetteer')
+DEFAULT_VINTAGE = 2023
+
+# level -> gazetteer file kind (CSAs have no gazetteer file and come from the TIGER attribute table)
+GAZETTEER_FILES = {'county': 'counties', 'place': 'place', 'cbsa': 'cbsa'}
+GAZETTEER_COLUMNS = ['level', 'geoid', 'name', 'state']
+STATE_LEVELS = ('county', 'place')
+
+# Legal/statistical area descriptions dropped from names so 'Cook' and 'Chicago' resolve like 'Cook County' and 'Chicago city'
+NAME_SUFFIX = re.compile(r"\s+(?:County|Parish|Borough|City and Borough|Census Area|Municipality|CDP|[a-z][^A-Z]*)$")
+
+
+def normalize_name(name):
+    return ' '.join(str(name).lower().split())
+
+def get_state_rows():
+    """States, DC and territories from the us package, so state lookups never need a download."""
+    states = us.states.STATES_AND_TERRITORIES
+    return pd.DataFrame({'level': 'state',
+                         'geoid': [state.fips for state in states],
+                         'name': [state.name for state in states],
+                         'state': [state.abbr for state in states]}, columns=GAZETTEER_COLUMNS)
+
+def get_gazetteer_url(kind, vintage):
+    return f"{GAZETTEER_URL}/{vintage}_Gazetteer/{vintage}_Gaz_{kind}_national.zip"
+
+def read_gazetteer_file(path):
+    """Reads a tab separated gazetteer file (zipped or not) with every column as text."""
+    df = pd.read_csv(path, sep='\t', dtype=str)
+    df.columns = df.columns.str.strip()
+    return df
+
+def build_gazetteer_table(counties, places, cbsas, csas):
+    """
+    Combines the sources into one table of (level, geoid, name, state).
+
+    :param counties: (DataFrame) County gazetteer file (USPS, GEOID, NAME)
+    :param places: (DataFrame) Place gazetteer file (USPS, GEOID, NAME)
+    :param cbsas: (DataFrame) CBSA gazetteer file (GEOID, NAME)
+    :param csas: (DataFrame) CSA TIGER attributes (GEOID, NAME)
+    """
+    frames = [get_state_rows()]
+    for level, df in (('county', counties), ('place', places), ('cbsa', cbsas), ('csa', csas)):
+        frames.append(pd.DataFrame({'level': level,
+                                    'geoid': df['GEOID'].to_numpy(),
+                                    'name': df['NAME'].to_numpy(),
+                                    'state': df['USPS'].to_numpy() if level in STATE_LEVELS else None}, columns=GAZETTEER_COLUMNS))
+    table = pd.concat(frames, ignore_index=True)
+    return table.astype({'level': 'category', 'geoid': 'string', 'name': 'string', 'state': 'category'})
+
+
+class gazetteer():
+    """
+    In-memory FIPS/name index of states, counties, places, CBSAs and CSAs.
+
+    The table is built once from the gazetteer files and the TIGER CSA layer
+    and persisted as parquet. States come from the us package and resolve
+    without loading the table at all.
+    """
+
+    def __init__(self, vintage=DEFAULT_VINTAGE, cache_dir=DEFAULT_GAZETTEER_DIR):
+        self.vintage = vintage
+        self.cache_dir = cache_dir
+        self.table = None
+        self.index_table(get_state_rows())
+
+    def get_path(self):
+        return os.path.join(self.cache_dir, f"{self.vintage}.parquet")
+
+    def fetch_file(self, kind):
+        path = os.path.join(self.cache_dir, f"{self.vintage}_Gaz_{kind}_national.zip")
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            download_file(get_gazetteer_url(kind, self.vintage), path)
+        return read_gazetteer_file(path)
+
+    def build(self):
+        """Downloads the sources and stores the combined table."""
+        sources = {level: self.fetch_file(kind) for level, kind in GAZETTEER_FILES.items()}
+        csas = pd.DataFrame(tigerCache().load(self.vintage, 'csa', columns=['GEOID', 'NAME']).drop(columns='geometry'))
+        table = build_gazetteer_table(sources['county'], sources['place'], sources['cbsa'], csas)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        table.to_parquet(f"{self.get_path()}.tmp", index=False)
+        os.replace(f"{self.get_path()}.tmp", self.get_path())
+        return table
+
+    def load(self, refresh=False):
+        if self.table is not None and not refresh:
+            return self.table
+        if refresh or not os.path.exists(self.get_path()):
+            self.table = self.build()
+        else:
+            self.table = pd.read_parquet(self.get_path())
+        self.index_table(self.table)
+        return self.table
+
+    def index_table(self, table):
+        """Builds the {(level, geoid): row} and {(level, state, name): geoid} dicts used by every lookup."""
+        self.names = {}
+        self.geoids = {}
+        matches = {}
+        levels = table['level'].astype(str).tolist()
+        geoid_values = table['geoid'].astype(str).tolist()
+        name_values = table['name'].astype(str).tolist()
+        state_values = table['state'].astype(object).where(table['state'].notna(), '').tolist()
+        for level, geoid, name, state in zip(levels, geoid_values, name_values, state_values):
+            self.names[(level, geoid)] = (name, state)
+            self.geoids[(level, state, normalize_name(name))] = geoid
+            if level == 'state':
+                self.geoids[(level, '', normalize_name(name))] = geoid
+                self.geoids[(level, '', state.lower())] = geoid
+                self.geoids[(level, '', geoid)] = geoid
+            else:
+                matches.setdefault((level, '', normalize_name(name)), set()).add(geoid)
+                alias = NAME_SUFFIX.sub('', name)
+                if alias != name:
+                    matches.setdefault((level, state, normalize_name(alias)), set()).add(geoid)
+                    matches.setdefault((level, '', normalize_name(alias)), set()).add(geoid)
+        # Aliases and names without a state only resolve when they are unique
+        for key, found in matches.items():
+            if len(found) == 1 and key not in self.geoids:
+                self.geoids[key] = found.pop()
+
+    def needs_table(self, level):
+        if level != 'state' and self.table is None:
+            self.load()
+
+    def get_state(self, state):
+        """Returns the state FIPS code for a state name, abbreviation or FIPS code, or None."""
+        return self.geoids.get(('state', '', normalize_name(state)))
+
+    def get_geoid(self, level, name, state=None):
+        """
+        :param level: (str) state, county, place, cbsa (msa) or csa
+        :param name: (str) Full name ('Cook County') or short name ('Cook'); states also accept abbreviations and FIPS
+        :param state: (str) State name, abbreviation or FIPS narrowing county and place names
+        :return: (str) GEOID, or None if the name is unknown or ambiguous without a state
+        """
+        level = get_level(level)
+        if level == 'state':
+            return self.get_state(name)
+        self.needs_table(level)
+        state_abbr = ''
+        if state is not None and level in STATE_LEVELS:
+            state_fips = self.get_state(state)
+            state_abbr = self.names[('state', state_fips)][1] if state_fips else None
+        return self.geoids.get((level, state_abbr, normalize_name(name)))
+
+    def get_name(self, level, geoid):
+        """Returns the name of a GEOID, or None."""
+        level = get_level(level)
+        self.needs_table(level)
+        entry = self.names.get((level, str(geoid)))
+        return entry[0] if entry else None
+
+gazetteers = {}
+
+def get_gazetteer(vintage=DEFAULT_VINTAGE):
+    """Returns the shared gazetteer of a vintage."""
+    if vintage not in gazetteers:
+        gazetteers[vintage] = gazetteer(vintage)
+    return gazetteers[vintage]
+
+
+class MyTestCase(unittest.TestCase):
+    counties = pd.DataFrame({'USPS': ['IL', 'MD', 'MD'], 'GEOID': ['17031', '24005', '24510'],
+                             'NAME': ['Cook County', 'Baltimore County', 'Baltimore city']})
+    places = pd.DataFrame({'USPS': ['IL', 'IL', 'MO'], 'GEOID': ['1714000', '1772000', '2970000'],
+                           'NAME': ['Chicago city', 'Springfield city', 'Springfield city']})
+    cbsas = pd.DataFrame({'GEOID': ['16980'], 'NAME': ['Chicago-Naperville-Elgin, IL-IN']})
+    csas = pd.DataFrame({'GEOID': ['176'], 'NAME': ['Chicago-Naperville, IL-IN-WI']})
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.gazetteer = gazetteer(2023, self.cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        build_gazetteer_table(self.counties, self.places, self.cbsas, self.csas).to_parquet(self.gazetteer.get_path(), index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_states_without_table(self):
+        self.assertEqual('17', self.gazetteer.get_geoid('state', 'Illinois'))
+        self.assertEqual('17', self.gazetteer.get_state('il'))
+        self.assertEqual('11', self.gazetteer.get_state('District of Columbia'))
+        self.assertIsNone(self.gazetteer.table)
+
+    def test_lookups(self):
+        self.assertEqual('17031', self.gazetteer.get_geoid('county', 'Cook'))
+        self.assertEqual('Cook County', self.gazetteer.get_name('county', '17031'))
+        self.assertEqual('24510', self.gazetteer.get_geoid('county', 'Baltimore city', state='MD'))
+        self.assertIsNone(self.gazetteer.get_geoid('county', 'Baltimore', state='MD'))
+        self.assertIsNone(self.gazetteer.get_geoid('place', 'Springfield'))
+        self.assertEqual('2970000', self.gazetteer.get_geoid('place', 'Springfield', state='Missouri'))
+        self.assertEqual('16980', self.gazetteer.get_geoid('msa', 'Chicago-Naperville-Elgin, IL-IN'))
+        self.assertEqual('Chicago-Naperville, IL-IN-WI', self.gazetteer.get_name('csa', 176))
+
+if __name__ == '__main__':
+    unittest.main()
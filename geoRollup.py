@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from geoidUtils import build_geoid, get_code_values, get_geoid_width, get_level
+
+# Nested summary levels, finest first; each GEOID is a prefix of its children's GEOIDs
+ROLLUP_LEVELS = ['block', 'block group', 'tract', 'county', 'state']
+
+
+def get_rollup_levels(level, levels=None):
+    """Returns the levels from level up to the coarsest requested one, in rollup order."""
+    level = get_level(level)
+    levels = [get_level(name) for name in levels] if levels else ROLLUP_LEVELS
+    if level not in ROLLUP_LEVELS:
+        raise ValueError(f"Cannot roll up from {level}")
+    return [name for name in ROLLUP_LEVELS[ROLLUP_LEVELS.index(level):] if name == level or name in levels]
+
+def get_value_matrix(df, variables):
+    """Stacks the variables into a float64 matrix with missing values counted as 0."""
+    matrix = np.empty((len(df), len(variables)), dtype=np.float64)
+    for i, variable in enumerate(variables):
+        matrix[:, i] = pd.to_numeric(df[variable]).to_numpy(dtype=np.float64, na_value=0)
+    return np.nan_to_num(matrix, nan=0.0)
+
+def reduce_sorted(keys, matrix):
+    """Sums the rows of matrix over runs of equal sorted keys, returning (unique keys, sums)."""
+    if not len(keys):
+        return keys, matrix
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    return keys[starts], np.add.reduceat(matrix, starts, axis=0)
+
+def rollup(df, variables, level='block', levels=None, geoid=None):
+    """
+    Aggregates additive variables of a fine level result up every coarser level at once.
+
+    Rows are sorted by GEOID once; each parent GEOID is the child GEOID with its last
+    digits dropped (integer division), so every level is a segment sum over the
+    previous, already sorted level. Non-additive variables (medians, ratios) must not
+    be rolled up this way.
+
+    :param df: (DataFrame) Census result at level, e.g. typed 'block:*' rows of a county
+    :param variables: (list) Count variables to sum, e.g. ['P001001']
+    :param level: (str) Summary level of df (block, block group, tract or county)
+    :param levels: (list) Levels to return (default: every level from level to state)
+    :param geoid: (str) Integer or code string GEOID column, built from the geography columns if None
+    :return: (dict) {level: DataFrame with an int64 GEOID column and the summed variables}
+    """
+    levels_to_build = get_rollup_levels(level, levels)
+    keys = get_code_values(df[geoid]) if geoid else build_geoid(df, level).to_numpy()
+    order = np.argsort(keys, kind='stable')
+    integer = [pd.api.types.is_integer_dtype(df[variable].dtype) for variable in variables]
+    keys, matrix = reduce_sorted(keys[order], get_value_matrix(df, variables)[order])
+    results = {}
+    previous = levels_to_build[0]
+    for name in levels_to_build:
+        if name != previous:
+            keys, matrix = reduce_sorted(keys // 10 ** (get_geoid_width(previous) - get_geoid_width(name)), matrix)
+            previous = name
+        frame = pd.DataFrame(matrix, columns=variables)
+        frame = frame.astype({variable: np.int64 for variable, is_int in zip(variables, integer) if is_int})
+        frame.insert(0, 'GEOID', keys)
+        if levels is None or name in [get_level(requested) for requested in levels]:
+            results[name] = frame
+    return results
+
+
+class MyTestCase(unittest.TestCase):
+    df = pd.DataFrame({'P001001': pd.array([10, 5, 7, 1, 2, None], dtype='Int32'),
+                       'H001001': [4.0, 2.0, 3.0, 1.0, 1.0, 2.0],
+                       'state': ['17', '17', '17', '17', '17', '18'],
+                       'county': ['031', '031', '031', '043', '031', '089'],
+                       'tract': ['010100', '010100', '010100', '840000', '010200', '010100'],
+                       'block': ['1001', '2000', '1000', '1000', '1000', '1000']})
+
+    def test_rollup_all_levels(self):
+        results = rollup(self.df, ['P001001', 'H001001'])
+        self.assertEqual(ROLLUP_LEVELS, list(results))
+        self.assertEqual([170310101001000, 170310101001001, 170310101002000], list(results['block']['GEOID'][:3]))
+        block_groups = results['block group']
+        self.assertEqual([170310101001, 170310101002, 170310102001, 170438400001, 180890101001], list(block_groups['GEOID']))
+        self.assertEqual([17, 5, 2, 1, 0], list(block_groups['P001001']))
+        self.assertEqual(np.int64, block_groups['P001001'].dtype)
+        tracts = results['tract'].set_index('GEOID')
+        self.assertEqual(24, tracts.loc[17031010100, 'P001001'] + tracts.loc[17031010200, 'P001001'])
+        self.assertEqual([24, 1, 0], list(results['county']['P001001']))
+        self.assertEqual([11.0, 2.0], list(results['state']['H001001']))
+
+    def test_rollup_matches_groupby(self):
+        tracts = rollup(self.df, ['H001001'], levels=['tract'])
+        self.assertEqual(['block', 'tract'], list(rollup(self.df, ['H001001'], levels=['block', 'tract'])))
+        self.assertEqual(['tract'], list(tracts))
+        expected = self.df.groupby(build_geoid(self.df, 'tract'))['H001001'].sum()
+        self.assertEqual(list(expected), list(tracts['tract']['H001001']))
+        from_tracts = rollup(tracts['tract'], ['H001001'], level='tract', geoid='GEOID')
+        self.assertEqual(list(from_tracts['county']['H001001']), [10.0, 1.0, 2.0])
+
+if __name__ == '__main__':
+    unittest.main()
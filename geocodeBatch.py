@@ -0,0 +1,238 @@
+import csv
+import io
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from censusCache import DEFAULT_CACHE_DIR
+from geoidUtils import build_geoid
+from httpUtils import http_post
+
+BATCH_URL = 'https://geocoding.geo.census.gov/geocoder/geographies/addressbatch'
+BATCH_SIZE = 10000  # addressbatch limit per file
+BATCH_TIMEOUT = 900
+MAX_WORKERS = 4
+DEFAULT_BENCHMARK = 'Public_AR_Current'
+DEFAULT_VINTAGE = 'Current_Current'
+DEFAULT_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIR, 'geocode')
+SQLITE_MAX_PARAMS = 900
+
+# columns of the addressbatch response (it has no header row)
+RESPONSE_COLUMNS = ['id', 'input_address', 'match', 'match_type', 'matched_address', 'coordinates',
+                    'tigerline_id', 'side', 'state', 'county', 'tract', 'block']
+RESULT_COLUMNS = ['match', 'match_type', 'matched_address', 'lon', 'lat', 'tigerline_id', 'side',
+                  'state', 'county', 'tract', 'block']
+FIPS_COLUMNS = ['state', 'county', 'tract', 'block']
+
+PUNCTUATION = re.compile(r"[.,#]")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_part(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    return WHITESPACE.sub(' ', PUNCTUATION.sub(' ', str(value).upper())).strip()
+
+def normalize_address(street, city, state, zip_code):
+    """Normalizes an address so spelling variants of the same address share one cache entry."""
+    zip_code = normalize_part(zip_code)[:5]
+    return '|'.join([normalize_part(street), normalize_part(city), normalize_part(state), zip_code])
+
+def build_batch_file(addresses):
+    """Writes normalized addresses as an addressbatch CSV, using the position as the unique id."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for i, address in enumerate(addresses):
+        writer.writerow([i, *address.split('|')])
+    return buffer.getvalue().encode()
+
+def parse_batch_response(text, addresses):
+    """Parses an addressbatch response into RESULT_COLUMNS rows indexed by normalized address."""
+    rows = list(csv.reader(io.StringIO(text)))
+    frame = pd.DataFrame([row + [''] * (len(RESPONSE_COLUMNS) - len(row)) for row in rows], columns=RESPONSE_COLUMNS)
+    frame['address'] = [addresses[int(i)] for i in frame['id']]
+    coordinates = frame['coordinates'].str.split(',', expand=True).reindex(columns=[0, 1])
+    frame['lon'] = pd.to_numeric(coordinates[0], errors='coerce')
+    frame['lat'] = pd.to_numeric(coordinates[1], errors='coerce')
+    return frame.set_index('address')[RESULT_COLUMNS].replace('', None)
+
+def build_result_frame(results, index):
+    """Types the results: categorical codes and match fields, float coordinates and a nullable int64 block GEOID."""
+    results = results.reindex(columns=RESULT_COLUMNS).set_axis(index)
+    for column in ['match', 'match_type', 'side', *FIPS_COLUMNS]:
+        results[column] = results[column].astype('category')
+    results['matched_address'] = results['matched_address'].astype('string')
+    results['tigerline_id'] = pd.to_numeric(results['tigerline_id']).astype('Int64')
+    results['lon'] = results['lon'].astype('float64')
+    results['lat'] = results['lat'].astype('float64')
+    matched = results[FIPS_COLUMNS].notna().all(axis=1).to_numpy()
+    geoid = pd.array(np.zeros(len(results), dtype=np.int64), dtype='Int64')
+    geoid[matched] = build_geoid(results.loc[matched, FIPS_COLUMNS], 'block').to_numpy()
+    geoid[~matched] = pd.NA
+    results['GEOID'] = geoid
+    return results
+
+
+class geocodeCache():
+    """Persistent sqlite cache of addressbatch results keyed on the normalized address."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        columns = ', '.join(f"{column} {'REAL' if column in ('lon', 'lat') else 'TEXT'}" for column in RESULT_COLUMNS)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, {columns})")
+
+    def get_many(self, addresses):
+        """Returns the cached results of the addresses as a DataFrame indexed by address."""
+        frames = []
+        for start in range(0, len(addresses), SQLITE_MAX_PARAMS):
+            chunk = addresses[start:start + SQLITE_MAX_PARAMS]
+            query = f"SELECT address, {', '.join(RESULT_COLUMNS)} FROM geocodes WHERE address IN ({', '.join('?' * len(chunk))})"
+            frames.append(pd.read_sql_query(query, self.connection, params=chunk))
+        if not frames:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        return pd.concat(frames, ignore_index=True).set_index('address')
+
+    def put_many(self, results):
+        rows = results.reset_index()[['address', *RESULT_COLUMNS]].astype(object)
+        rows = rows.where(rows.notna(), None)
+        placeholders = ', '.join('?' * (len(RESULT_COLUMNS) + 1))
+        with self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO geocodes VALUES ({placeholders})", rows.itertuples(index=False, name=None))
+
+    def close(self):
+        self.connection.close()
+
+
+class batchGeocoder():
+    """
+    Geocodes address tables through the Census addressbatch endpoint.
+
+    Addresses are normalized and deduplicated, cached addresses (matched or
+    not) never go back to the network, and the rest are sent in batches of
+    up to 10k that run concurrently.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_PATH, benchmark=DEFAULT_BENCHMARK, vintage=DEFAULT_VINTAGE,
+                 batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+        """
+        :param cache_dir: (str) Directory of the sqlite caches, one per benchmark/vintage
+        :param benchmark: (str) Geocoder benchmark
+        :param vintage: (str) Geocoder vintage the geographies are returned for
+        :param batch_size: (int) Addresses per request (at most 10000)
+        :param max_workers: (int) Batches in flight at once
+        """
+        if batch_size > BATCH_SIZE:
+            raise ValueError(f"addressbatch accepts at most {BATCH_SIZE} addresses per request")
+        self.benchmark = benchmark
+        self.vintage = vintage
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.cache = geocodeCache(os.path.join(cache_dir, f"{benchmark}_{vintage}.sqlite"))
+
+    def post_batch(self, addresses):
+        response = http_post(BATCH_URL,
+                             data={'benchmark': self.benchmark, 'vintage': self.vintage},
+                             files={'addressFile': ('addresses.csv', build_batch_file(addresses), 'text/csv')},
+                             timeout=BATCH_TIMEOUT)
+        response.raise_for_status()
+        return parse_batch_response(response.text, addresses)
+
+    def fetch(self, addresses):
+        """
+        Geocodes uncached addresses, storing each batch in the cache as it completes.
+        Every batch that succeeded is cached before the first failure is raised.
+        """
+        batches = [addresses[start:start + self.batch_size] for start in range(0, len(addresses), self.batch_size)]
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.post_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                self.cache.put_many(future.result())
+        if error is not None:
+            raise error
+
+    def geocode(self, df, street='street', city='city', state='state', zip_code='zip'):
+        """
+        :param df: (DataFrame) Addresses, one column per address part
+        :return: (DataFrame) RESULT_COLUMNS and a block GEOID per row of df (same index)
+        """
+        keys = [normalize_address(*parts) for parts in zip(df[street], df[city], df[state], df[zip_code])]
+        unique = list(dict.fromkeys(keys))
+        cached = self.cache.get_many(unique)
+        missing = [address for address in unique if address not in cached.index]
+        if missing:
+            print(f"Geocoding {len(missing)} of {len(unique)} unique addresses...")
+            self.fetch(missing)
+            cached = self.cache.get_many(unique)
+        return build_result_frame(cached.reindex(keys), df.index)
+
+
+class MyTestCase(unittest.TestCase):
+    response = ('"0","1 N STATE ST, CHICAGO, IL, 60602","Match","Exact","1 N STATE ST, CHICAGO, IL, 60602",'
+                '"-87.62,41.88","1234","L","17","031","839100","2001"\n'
+                '"1","999 NOWHERE RD, CHICAGO, IL, 60601","No_Match"\n')
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.batches = []
+        self.failing = set()
+        test = self
+
+        class offlineGeocoder(batchGeocoder):
+            def post_batch(self, addresses):
+                test.batches.append(addresses)
+                if addresses[0] in test.failing:
+                    raise Exception("addressbatch request failed")
+                return parse_batch_response(test.response, addresses)
+        self.geocoder = offlineGeocoder(self.cache_dir)
+
+    def tearDown(self):
+        self.geocoder.cache.close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_normalize_address(self):
+        self.assertEqual('1 N STATE ST|CHICAGO|IL|60602', normalize_address(' 1 n. State St, ', 'Chicago', 'il', '60602-1234'))
+
+    def test_geocode_uses_cache(self):
+        df = pd.DataFrame({'street': ['1 N State St', '999 Nowhere Rd', '1 n. state st'],
+                           'city': ['Chicago'] * 3, 'state': ['IL'] * 3, 'zip': ['60602', '60601', '60602']})
+        results = self.geocoder.geocode(df)
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual(2, len(self.batches[0]))
+        self.assertEqual(170318391002001, results['GEOID'][0])
+        self.assertTrue(pd.isna(results['GEOID'][1]))
+        self.assertEqual('category', results['county'].dtype)
+        self.assertEqual(-87.62, results['lon'][2])
+        again = self.geocoder.geocode(df)
+        self.assertEqual(1, len(self.batches))
+        self.assertTrue(again['GEOID'].equals(results['GEOID']))
+
+    def test_failed_batch_keeps_completed_batches(self):
+        self.response = self.response.splitlines(keepends=True)[0]
+        self.geocoder.batch_size = 1
+        self.geocoder.max_workers = 1
+        df = pd.DataFrame({'street': ['1 N State St', '2 N State St'], 'city': ['Chicago'] * 2,
+                           'state': ['IL'] * 2, 'zip': ['60602'] * 2})
+        self.failing.add('2 N STATE ST|CHICAGO|IL|60602')
+        with self.assertRaises(Exception):
+            self.geocoder.geocode(df)
+        self.assertEqual(1, len(self.geocoder.cache.get_many(['1 N STATE ST|CHICAGO|IL|60602'])))
+        self.failing.clear()
+        results = self.geocoder.geocode(df)
+        self.assertEqual([['2 N STATE ST|CHICAGO|IL|60602']], self.batches[2:])
+        self.assertEqual(170318391002001, results['GEOID'][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point
+
+# summary level -> (census api geography column, digits) in GEOID order
+GEOID_COMPONENTS = {
+    'state': [('state', 2)],
+    'county': [('state', 2), ('county', 3)],
+    'tract': [('state', 2), ('county', 3), ('tract', 6)],
+    'block group': [('state', 2), ('county', 3), ('tract', 6), ('block group', 1)],
+    'block': [('state', 2), ('county', 3), ('tract', 6), ('block', 4)],
+    'place': [('state', 2), ('place', 5)],
+    'cbsa': [('metropolitan statistical area/micropolitan statistical area', 5)],
+    'csa': [('combined statistical area', 3)],
+}
+LEVEL_ALIASES = {'bg': 'block group', 'tabblock': 'block', 'msa': 'cbsa'}
+
+
+def get_level(level):
+    level = LEVEL_ALIASES.get(level, level)
+    if level not in GEOID_COMPONENTS:
+        raise ValueError(f"Unknown summary level: {level}")
+    return level
+
+def get_geoid_width(level):
+    return sum(width for column, width in GEOID_COMPONENTS[get_level(level)])
+
+def get_code_values(column):
+    """Converts a column of FIPS code strings to int64, converting each category only once for categoricals."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = pd.to_numeric(column.cat.categories.astype(str)).to_numpy(dtype=np.int64)
+        return categories[column.cat.codes.to_numpy()]
+    return pd.to_numeric(column).to_numpy(dtype=np.int64)
+
+def build_geoid(df, level, as_int=True):
+    """
+    Builds the GEOID of a summary level from the census api geography columns.
+
+    :param df: (DataFrame) Census result with the geography columns (state, county, tract, ...)
+    :param level: (str) Summary level, one of GEOID_COMPONENTS (or bg/tabblock/msa)
+    :param as_int: (bool) Return int64 keys, otherwise zero padded fixed-width strings
+    :return: (Series) GEOIDs aligned with df
+    """
+    geoid = np.zeros(len(df), dtype=np.int64)
+    for column, width in GEOID_COMPONENTS[get_level(level)]:
+        geoid = geoid * 10 ** width + get_code_values(df[column])
+    if as_int:
+        return pd.Series(geoid, index=df.index, name='GEOID')
+    return pd.Series(geoid, index=df.index, name='GEOID').astype(str).str.zfill(get_geoid_width(level))
+
+def geoid_to_int(column):
+    """Converts a TIGER GEOID string column to int64 keys."""
+    return pd.Series(get_code_values(column), index=column.index, name=column.name)
+
+
+class geoidIndex():
+    """Sorted int64 GEOID keys of a frame (usually a TIGER layer), built once and reused across joins."""
+
+    def __init__(self, frame, key):
+        self.frame = frame
+        self.key = key
+        keys = get_code_values(frame[key])
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+        if len(self.sorted_keys) > 1 and not (np.diff(self.sorted_keys) > 0).all():
+            raise ValueError(f"Duplicate GEOIDs in {key}")
+
+    def lookup(self, keys):
+        """Returns (positions into frame, matched mask) for each key; positions are -1 when the index is empty."""
+        if not len(self.sorted_keys):
+            return np.full(len(keys), -1, dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        positions = np.searchsorted(self.sorted_keys, keys)
+        positions = np.minimum(positions, len(self.sorted_keys) - 1)
+        matched = self.sorted_keys[positions] == keys
+        return self.order[positions], matched
+
+def join_on_geoid(left, right, left_on='GEOID', right_on='GEOID', how='inner'):
+    """
+    Joins census results to a TIGER layer on integer GEOIDs using a binary search over
+    the sorted right keys instead of a hash merge on strings.
+
+    :param left: (DataFrame) Census result with an int64 (or code string) GEOID column
+    :param right: (DataFrame|GeoDataFrame|geoidIndex) Layer with unique GEOIDs, or a prebuilt index of one
+    :param how: (str) 'inner' or 'left'
+    :return: (DataFrame|GeoDataFrame) Left columns followed by the right columns (right key dropped)
+    """
+    index = right if isinstance(right, geoidIndex) else geoidIndex(right, right_on)
+    right = index.frame
+    positions, matched = index.lookup(get_code_values(left[left_on]))
+    right_columns = [column for column in right.columns if column != index.key]
+    if how == 'inner':
+        left_part = left.iloc[np.flatnonzero(matched)].reset_index(drop=True)
+        right_part = right.iloc[positions[matched]][right_columns].reset_index(drop=True)
+    elif how == 'left':
+        left_part = left.reset_index(drop=True)
+        if len(right):
+            right_part = right.iloc[positions][right_columns].reset_index(drop=True)
+        else:
+            right_part = pd.DataFrame(index=left_part.index, columns=right_columns)
+        right_part.loc[~matched, :] = None
+    else:
+        raise ValueError(f"Unsupported join: {how}")
+    right_part.columns = [f"{column}_right" if column in left_part.columns else column for column in right_part.columns]
+    merged = pd.concat([left_part, right_part], axis=1)
+    if isinstance(right, gpd.GeoDataFrame):
+        geometry = right.geometry.name
+        return gpd.GeoDataFrame(merged, geometry=geometry if geometry in merged.columns else f"{geometry}_right", crs=right.crs)
+    return merged
+
+
+class MyTestCase(unittest.TestCase):
+    df = pd.DataFrame({'P001001': [128, 7, 0],
+                       'state': ['17', '17', '17'],
+                       'county': ['031', '031', '031'],
+                       'tract': ['010100', '010100', '842300'],
+                       'block': ['1000', '1001', '2005']})
+
+    def test_build_block_geoid(self):
+        geoid = build_geoid(self.df, 'block')
+        self.assertEqual(np.int64, geoid.dtype)
+        self.assertEqual(170310101001000, geoid[0])
+        self.assertEqual('170310101001000', build_geoid(self.df, 'block', as_int=False)[0])
+
+    def test_categorical_codes(self):
+        df = self.df.astype({'state': 'category', 'county': 'category', 'tract': 'category'})
+        self.assertTrue(build_geoid(df, 'tract').equals(build_geoid(self.df, 'tract')))
+
+    def test_join_on_geoid(self):
+        df = self.df.assign(GEOID=build_geoid(self.df, 'block'))
+        blocks = gpd.GeoDataFrame({'GEOID10': ['170318423002005', '170310101001000'], 'ALAND10': [10, 20]},
+                                  geometry=[Point(1, 1), Point(0, 0)])
+        merged = join_on_geoid(df, blocks, right_on='GEOID10')
+        self.assertIsInstance(merged, gpd.GeoDataFrame)
+        self.assertEqual([128, 0], list(merged['P001001']))
+        self.assertEqual([20, 10], list(merged['ALAND10']))
+        left = join_on_geoid(df, geoidIndex(blocks, 'GEOID10'), how='left')
+        self.assertEqual(3, len(left))
+        self.assertTrue(pd.isna(left['ALAND10'][1]))
+
+    def test_empty_index(self):
+        positions, matched = geoidIndex(pd.DataFrame({'GEOID': pd.Series([], dtype=str)}), 'GEOID').lookup(np.array([17031, 17043]))
+        self.assertEqual([-1, -1], list(positions))
+        self.assertFalse(matched.any())
+        empty = gpd.GeoDataFrame({'GEOID': pd.Series([], dtype=str)}, geometry=gpd.GeoSeries([]))
+        df = self.df.assign(GEOID=build_geoid(self.df, 'block'))
+        self.assertEqual(0, len(join_on_geoid(df, empty)))
+        self.assertEqual(3, len(join_on_geoid(df, empty, how='left')))
+
+if __name__ == '__main__':
+    unittest.main()
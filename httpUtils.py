@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_TIMEOUT = 60
+DEFAULT_HOST_POOL_SIZES = {
+    'https://api.census.gov': 32,
+    'https://geocoding.geo.census.gov': 16,
+    'https://www2.census.gov': 4,
+    'https://data.cityofchicago.org': 16,
+}
+
+session = None
+session_lock = threading.RLock()
+request_timeout = DEFAULT_TIMEOUT
+
+def create_adapter(pool_maxsize, pool_connections=DEFAULT_POOL_CONNECTIONS, max_retries=3):
+    retries = Retry(total=max_retries,
+                    backoff_factor=0.5,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=('GET', 'HEAD'),
+                    # Hand the last 429/5xx response back to the caller's status checks instead of raising RetryError
+                    raise_on_status=False)
+    return HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retries)
+
+def configure_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                      host_pool_sizes=None, max_retries=3, keep_alive=True, headers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Replaces the shared session every API client in the package sends its requests through.
+
+    :param pool_connections: (int) Number of host pools cached by the default adapter
+    :param pool_maxsize: (int) Connections kept alive per host for hosts without their own size
+    :param host_pool_sizes: (dict) {url_prefix: pool_maxsize} overrides (default: DEFAULT_HOST_POOL_SIZES)
+    :param max_retries: (int) Retries on connection errors and 429/5xx responses
+    :param keep_alive: (bool) Reuse connections between requests
+    :param headers: (dict) Extra headers sent with every request
+    :param timeout: (float) Default request timeout in seconds
+    :return: (requests.Session) The new shared session
+    """
+    global session, request_timeout
+    if host_pool_sizes is None:
+        host_pool_sizes = DEFAULT_HOST_POOL_SIZES
+    new_session = requests.Session()
+    adapter = create_adapter(pool_maxsize, pool_connections, max_retries)
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    for prefix, size in host_pool_sizes.items():
+        new_session.mount(prefix, create_adapter(size, 1, max_retries))
+    if not keep_alive:
+        new_session.headers['Connection'] = 'close'
+    if headers:
+        new_session.headers.update(headers)
+    with session_lock:
+        old_session = session
+        session = new_session
+        request_timeout = timeout
+    if old_session is not None:
+        old_session.close()
+    return new_session
+
+def get_session():
+    """Returns the shared pooled session, creating it with the defaults on first use."""
+    if session is None:
+        with session_lock:
+            # Another thread may have created it while this one waited for the lock
+            if session is None:
+                return configure_session()
+    return session
+
+def close_session():
+    global session
+    with session_lock:
+        old_session = session
+        session = None
+    if old_session is not None:
+        old_session.close()
+
+def http_get(url, params=None, **kwargs):
+    kwargs.setdefault('timeout', request_timeout)
+    return get_session().get(url, params=params, **kwargs)
+
+def http_post(url, data=None, files=None, **kwargs):
+    kwargs.setdefault('timeout', request_timeout)
+    return get_session().post(url, data=data, files=files, **kwargs)
+
+def download_file(url, save_path, chunk_size=1 << 20):
+    """Streams a download to disk, writing to a temporary file first so partial downloads are never left behind."""
+    response = http_get(url, stream=True)
+    if response.status_code != 200:
+        raise Exception(f"Failed to download: {response.status_code}")
+    tmp_path = f"{save_path}.part"
+    try:
+        with open(tmp_path, "wb") as file:
+            for chunk in response.iter_content(chunk_size):
+                file.write(chunk)
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return save_path
+
+
+class MyTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        close_session()
+
+    def test_host_pool_sizes(self):
+        s = configure_session(pool_maxsize=5, host_pool_sizes={'https://api.census.gov': 40})
+        self.assertEqual(40, s.get_adapter('https://api.census.gov/data/2010/dec/sf1')._pool_maxsize)
+        self.assertEqual(5, s.get_adapter('https://example.com/')._pool_maxsize)
+        self.assertFalse(s.get_adapter('https://example.com/').max_retries.raise_on_status)
+
+    def test_get_session_is_shared(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_first_use_from_many_threads(self):
+        close_session()
+        barrier = threading.Barrier(8)
+
+        def first_use():
+            barrier.wait()
+            return get_session()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            sessions = list(executor.map(lambda i: first_use(), range(8)))
+        self.assertEqual(1, len({id(s) for s in sessions}))
+        self.assertIs(session, sessions[0])
+
+    def test_failed_download_removes_part_file(self):
+        class brokenResponse():
+            status_code = 200
+
+            def iter_content(self, chunk_size):
+                yield b'partial'
+                raise requests.exceptions.ChunkedEncodingError("connection dropped")
+        save_dir = tempfile.mkdtemp()
+        save_path = os.path.join(save_dir, 'layer.zip')
+        get_session().get = lambda *args, **kwargs: brokenResponse()
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            download_file('https://www2.census.gov/layer.zip', save_path)
+        self.assertEqual([], os.listdir(save_dir))
+        shutil.rmtree(save_dir)
+
+if __name__ == '__main__':
+    unittest.main()
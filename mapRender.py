@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import matplotlib
+import shapely
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PathCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+from matplotlib.path import Path
+from shapely.geometry import box
+
+from geoidUtils import geoidIndex, get_code_values
+from tigerCache import DEFAULT_FIGSIZE, DEFAULT_DPI
+
+DEFAULT_CLASSES = 5
+DEFAULT_CMAP = 'BuPu'
+MISSING_COLOR = (0.85, 0.85, 0.85, 1.0)
+
+# Geometry held by each worker process, set once by init_worker
+worker_paths = None
+
+
+def get_polygons(geometry):
+    """Returns the polygon parts of a geometry; None, empty and non-areal parts (points, lines) have none."""
+    if geometry is None or geometry.is_empty:
+        return []
+    if geometry.geom_type == 'Polygon':
+        return [geometry]
+    if geometry.geom_type in ('MultiPolygon', 'GeometryCollection'):
+        return [polygon for part in geometry.geoms for polygon in get_polygons(part)]
+    return []
+
+def polygon_to_path(geometry):
+    """
+    Builds one compound matplotlib path per feature (all parts and holes) so each feature gets one face color.
+    Features without polygon parts get an empty path, so they keep their position but draw nothing.
+    """
+    vertices = []
+    codes = []
+    for polygon in get_polygons(geometry):
+        for ring in [polygon.exterior, *polygon.interiors]:
+            coords = np.asarray(ring.coords)[:, :2]
+            ring_codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+            ring_codes[0] = Path.MOVETO
+            ring_codes[-1] = Path.CLOSEPOLY
+            vertices.append(coords)
+            codes.append(ring_codes)
+    if not vertices:
+        return Path(np.empty((0, 2)))
+    return Path(np.concatenate(vertices), np.concatenate(codes))
+
+def geometry_to_paths(wkb):
+    return [polygon_to_path(geometry) for geometry in shapely.from_wkb(wkb)]
+
+def init_worker(wkb):
+    global worker_paths
+    worker_paths = geometry_to_paths(wkb)
+
+def quantile_breaks(matrix, k=DEFAULT_CLASSES):
+    """Returns the (k + 1, n_columns) quantile class breaks of every column at once, ignoring NaN."""
+    return np.nanquantile(matrix, np.linspace(0, 1, k + 1), axis=0)
+
+def classify(matrix, breaks):
+    """Returns int8 class indices (0..k-1, -1 for missing) for every cell of the matrix."""
+    classes = np.empty(matrix.shape, dtype=np.int8)
+    for column in range(matrix.shape[1]):
+        classes[:, column] = np.searchsorted(breaks[1:-1, column], matrix[:, column], side='right')
+    classes[np.isnan(matrix)] = -1
+    return classes
+
+def format_break(value):
+    return f"{value:,.0f}" if abs(value) >= 100 else f"{value:,.3g}"
+
+def render_map(task):
+    """Draws one choropleth with the worker's geometry and writes it to task['path']."""
+    classes = task['classes']
+    breaks = task['breaks']
+    k = len(breaks) - 1
+    palette = matplotlib.colormaps[task['cmap']].resampled(k)(np.arange(k))
+    facecolors = palette[np.maximum(classes, 0)]
+    facecolors[classes < 0] = MISSING_COLOR
+    fig = Figure(figsize=task['figsize'])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.add_collection(PathCollection(worker_paths, facecolors=facecolors, edgecolors='none', linewidths=0))
+    ax.autoscale_view()
+    ax.set_aspect('equal')
+    ax.axis('off')
+    ax.set_title(task['title'], fontsize=14)
+    handles = [Patch(facecolor=palette[i], label=f"{format_break(breaks[i])} - {format_break(breaks[i + 1])}") for i in range(k)]
+    ax.legend(handles=handles, loc='upper left', bbox_to_anchor=(1, 1))
+    fig.tight_layout()
+    fig.savefig(task['path'], dpi=task['dpi'])
+    return task['path']
+
+
+class choroplethRenderer():
+    """
+    Headless renderer for many choropleths over one geometry layer.
+
+    The geometry is converted to matplotlib paths once per worker process and
+    reused for every map; class breaks for all maps are computed together.
+    """
+
+    def __init__(self, geometry, key, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI, cmap=DEFAULT_CMAP, k=DEFAULT_CLASSES):
+        """
+        :param geometry: (GeoDataFrame) Layer to draw, e.g. from tigerCache.load_simplified
+        :param key: (str) GEOID column of the layer values are matched on
+        :param k: (int) Number of quantile classes
+        """
+        self.geometry = geometry
+        self.index = geoidIndex(geometry, key)
+        self.wkb = shapely.to_wkb(geometry.geometry.values)
+        self.figsize = figsize
+        self.dpi = dpi
+        self.cmap = cmap
+        self.k = k
+
+    def align(self, values, key, column):
+        """Returns the column reordered to the geometry rows, NaN where a feature has no value."""
+        aligned = np.full(len(self.geometry), np.nan)
+        positions, matched = self.index.lookup(get_code_values(values[key]))
+        aligned[positions[matched]] = pd.to_numeric(values[column]).to_numpy(dtype=np.float64, na_value=np.nan)[matched]
+        return aligned
+
+    def render(self, sources, output_dir, fmt='png', processes=None):
+        """
+        :param sources: (list) (name, values DataFrame, key column, value column, title) per map
+        :param output_dir: (str) Directory the images are written to as <name>.<fmt>
+        :param fmt: (str) 'png' or 'svg'
+        :param processes: (int) Worker processes (default: cpu count, 1 = render in this process)
+        :return: (list) Paths of the written images
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        matrix = np.column_stack([self.align(values, key, column) for name, values, key, column, title in sources])
+        breaks = quantile_breaks(matrix, self.k)
+        classes = classify(matrix, breaks)
+        tasks = [{'classes': classes[:, i],
+                  'breaks': breaks[:, i],
+                  'title': title,
+                  'path': os.path.join(output_dir, f"{name}.{fmt}"),
+                  'cmap': self.cmap,
+                  'figsize': self.figsize,
+                  'dpi': self.dpi} for i, (name, values, key, column, title) in enumerate(sources)]
+        if processes == 1:
+            init_worker(self.wkb)
+            return [render_map(task) for task in tasks]
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(self.wkb,)) as executor:
+            return list(executor.map(render_map, tasks))
+
+    def render_variables(self, values, key, columns, output_dir, titles=None, fmt='png', processes=None):
+        """Renders one map per variable column of a census result."""
+        titles = titles or {}
+        sources = [(column, values, key, column, titles.get(column, column)) for column in columns]
+        return self.render(sources, output_dir, fmt, processes)
+
+    def render_vintages(self, frames, key, column, output_dir, title=None, fmt='png', processes=None):
+        """Renders one map of the same variable per vintage from {vintage: census result}."""
+        sources = [(f"{column}_{vintage}", values, key, column, f"{title or column} ({vintage})") for vintage, values in frames.items()]
+        return self.render(sources, output_dir, fmt, processes)
+
+
+class MyTestCase(unittest.TestCase):
+    geometry = gpd.GeoDataFrame({'GEOID': ['17031010100', '17031010200', '17031010300', '17031010400']},
+                                geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(0, 1, 1, 2), box(1, 1, 2, 2)])
+    values = pd.DataFrame({'GEOID': [17031010400, 17031010100, 17031010200],
+                           'P001001': [40, 10, 20],
+                           'P001002': [1.5, 2.5, 3.5]})
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def test_paths_of_degenerate_geometries(self):
+        collection = shapely.GeometryCollection([shapely.Point(5, 5), box(0, 0, 1, 1), shapely.LineString([(0, 0), (1, 1)])])
+        self.assertEqual(5, len(polygon_to_path(collection).vertices))
+        for geometry in (None, shapely.Polygon(), shapely.Point(0, 0), shapely.MultiPolygon()):
+            self.assertEqual(0, len(polygon_to_path(geometry).vertices))
+        wkb = shapely.to_wkb(np.array([box(0, 0, 1, 1), None], dtype=object))
+        self.assertEqual([5, 0], [len(path.vertices) for path in geometry_to_paths(wkb)])
+
+    def test_breaks_and_classes(self):
+        matrix = np.array([[1.0, 10.0], [2.0, np.nan], [3.0, 30.0], [4.0, 40.0]])
+        breaks = quantile_breaks(matrix, 2)
+        self.assertEqual([2.5, 30.0], list(breaks[1]))
+        self.assertEqual([[0, 0], [0, -1], [1, 1], [1, 1]], classify(matrix, breaks).tolist())
+
+    def test_align_to_geometry(self):
+        renderer = choroplethRenderer(self.geometry, 'GEOID')
+        aligned = renderer.align(self.values, 'GEOID', 'P001001')
+        self.assertEqual([10.0, 20.0, 40.0], [aligned[0], aligned[1], aligned[3]])
+        self.assertTrue(np.isnan(aligned[2]))
+
+    def test_render_files(self):
+        renderer = choroplethRenderer(self.geometry, 'GEOID', figsize=(4, 3), dpi=50, k=2)
+        paths = renderer.render_variables(self.values, 'GEOID', ['P001001', 'P001002'], self.output_dir, processes=1)
+        paths += renderer.render_vintages({2010: self.values, 2020: self.values}, 'GEOID', 'P001001', self.output_dir, fmt='svg', processes=2)
+        self.assertEqual(4, len(paths))
+        with open(paths[0], 'rb') as file:
+            self.assertEqual(b'\x89PNG', file.read(4))
+        self.assertTrue(paths[-1].endswith('P001001_2020.svg') and os.path.exists(paths[-1]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import re
+import unittest
+
+AGGREGATES = ('count', 'sum', 'avg', 'min', 'max')
+DATE_TRUNCS = {'year': 'date_trunc_y', 'month': 'date_trunc_ym', 'day': 'date_trunc_ymd'}
+SOQL_KEYWORDS = {'and', 'or', 'not', 'is', 'null', 'in', 'between', 'like', 'as', 'asc', 'desc', 'true', 'false', 'distinct'}
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+IDENTIFIER = re.compile(r"(?<![\w:.])(:?[A-Za-z_]\w*)(\s*\()?")
+ALIAS = re.compile(r"\bAS\s+(\w+)", re.IGNORECASE)
+AGGREGATE_CALL = re.compile(rf"\b(?:{'|'.join(AGGREGATES)})\s*\(", re.IGNORECASE)
+
+
+def quote(value):
+    """Formats a python value as a SoQL literal."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def aggregate(function, field='*', alias=None):
+    """Builds an aggregate expression, e.g. aggregate('count', alias='crimes') -> 'count(*) AS crimes'."""
+    if function not in AGGREGATES:
+        raise ValueError(f"Unsupported aggregate: {function}")
+    expression = f"{function}({field})"
+    return f"{expression} AS {alias}" if alias else expression
+
+def date_trunc(field, unit='month', alias=None):
+    """Truncates a timestamp field to the year, month or day so it can be grouped on."""
+    if unit not in DATE_TRUNCS:
+        raise ValueError(f"Unsupported date unit: {unit}")
+    expression = f"{DATE_TRUNCS[unit]}({field})"
+    return f"{expression} AS {alias}" if alias else expression
+
+def get_expression_fields(expression):
+    """Returns the column names referenced by a SoQL expression (literals, keywords and functions skipped)."""
+    expression = STRING_LITERAL.sub(' ', expression)
+    fields = set()
+    for name, call in IDENTIFIER.findall(expression):
+        if not call and name.lower() not in SOQL_KEYWORDS:
+            fields.add(name)
+    return fields
+
+def get_metadata_fields(metadata):
+    """Returns the API field names of a dataset from get_dataset_metadata."""
+    fields = set()
+    for column in metadata.get('columns', []):
+        fields.add(column.get('fieldName') or column['name'])
+    return fields
+
+
+class soqlQuery():
+    """
+    Builds Socrata (SoQL) queries so filtering and aggregation run on the portal.
+
+    Every method returns the query so calls can be chained:
+        soqlQuery().select('ward', aggregate('count', alias='crimes')).where_equals('primary_type', 'THEFT').group('ward')
+    """
+
+    def __init__(self):
+        self.selects = []
+        self.wheres = []
+        self.groups = []
+        self.havings = []
+        self.orders = []
+        self.limit_value = None
+
+    def select(self, *expressions):
+        self.selects.extend(expressions)
+        return self
+
+    def where(self, expression):
+        """Adds a raw $where condition; conditions are combined with AND."""
+        self.wheres.append(expression)
+        return self
+
+    def where_equals(self, field, value):
+        return self.where(f"{field} = {quote(value)}")
+
+    def where_in(self, field, values):
+        return self.where(f"{field} IN ({', '.join(quote(value) for value in values)})")
+
+    def where_between(self, field, low, high):
+        return self.where(f"{field} BETWEEN {quote(low)} AND {quote(high)}")
+
+    def group(self, *expressions):
+        self.groups.extend(expressions)
+        return self
+
+    def having(self, expression):
+        self.havings.append(expression)
+        return self
+
+    def order(self, expression, descending=False):
+        self.orders.append(f"{expression} DESC" if descending else expression)
+        return self
+
+    def limit(self, limit):
+        self.limit_value = limit
+        return self
+
+    def is_aggregate(self):
+        """True if a select aggregates rows, e.g. sum(x); without a group the result is a single row."""
+        return any(AGGREGATE_CALL.search(STRING_LITERAL.sub(' ', expression)) for expression in self.selects)
+
+    def get_aliases(self):
+        return {alias for expression in self.selects for alias in ALIAS.findall(expression)}
+
+    def get_fields(self):
+        """Returns every column referenced by the query, excluding select aliases."""
+        fields = set()
+        for expression in self.selects + self.wheres + self.groups + self.havings + self.orders:
+            fields |= get_expression_fields(ALIAS.sub('', expression))
+        return fields - self.get_aliases()
+
+    def validate(self, metadata):
+        """Raises ValueError if the query references columns the dataset does not have."""
+        known = get_metadata_fields(metadata)
+        unknown = sorted(field for field in self.get_fields() if not field.startswith(':') and field not in known)
+        if unknown:
+            raise ValueError(f"Unknown fields in query: {', '.join(unknown)}")
+
+    def get_params(self):
+        params = {}
+        if self.selects:
+            params['$select'] = ', '.join(self.selects)
+        if self.wheres:
+            params['$where'] = ' AND '.join(f"({expression})" if len(self.wheres) > 1 else expression for expression in self.wheres)
+        if self.groups:
+            params['$group'] = ', '.join(self.groups)
+        if self.havings:
+            params['$having'] = ' AND '.join(f"({expression})" if len(self.havings) > 1 else expression for expression in self.havings)
+        if self.orders:
+            params['$order'] = ', '.join(self.orders)
+        if self.limit_value is not None:
+            params['$limit'] = self.limit_value
+        return params
+
+
+class MyTestCase(unittest.TestCase):
+    metadata = {'columns': [{'name': 'Ward', 'fieldName': 'ward', 'dataTypeName': 'number'},
+                            {'name': 'Primary Type', 'fieldName': 'primary_type', 'dataTypeName': 'text'},
+                            {'name': 'Date', 'fieldName': 'date', 'dataTypeName': 'calendar_date'}]}
+
+    def get_query(self):
+        return (soqlQuery()
+                .select('ward', date_trunc('date', 'month', alias='month'), aggregate('count', alias='crimes'))
+                .where_equals('primary_type', "O'HARE THEFT")
+                .where("date >= '2024-01-01T00:00:00'")
+                .group('ward', date_trunc('date', 'month'))
+                .having('count(*) > 10')
+                .order('crimes', descending=True))
+
+    def test_params(self):
+        params = self.get_query().get_params()
+        self.assertEqual('ward, date_trunc_ym(date) AS month, count(*) AS crimes', params['$select'])
+        self.assertEqual("(primary_type = 'O''HARE THEFT') AND (date >= '2024-01-01T00:00:00')", params['$where'])
+        self.assertEqual('ward, date_trunc_ym(date)', params['$group'])
+        self.assertEqual('count(*) > 10', params['$having'])
+        self.assertEqual('crimes DESC', params['$order'])
+
+    def test_validate(self):
+        query = self.get_query()
+        self.assertEqual({'ward', 'date', 'primary_type'}, query.get_fields())
+        self.assertTrue(query.is_aggregate())
+        self.assertFalse(soqlQuery().select('ward', "'count(x)' AS label").is_aggregate())
+        query.validate(self.metadata)
+        with self.assertRaises(ValueError):
+            query.where('district = 4').validate(self.metadata)
+
+if __name__ == '__main__':
+    unittest.main()
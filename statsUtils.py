@@ -1,6 +1,15 @@
+import unittest
+
 import numpy as np
+import pandas as pd
 from scipy import stats
 
+from censusFrame import CENSUS_SENTINELS, CONTROLLED_MOE
+from censusVariables import get_moe_variable
+
+DEFAULT_BINS = 3
+MOE_Z = 1.645  # ACS margins of error are published at the 90% confidence level
+
 def create_ratio_column(df, column_numerator, column_denominator, new_column_name):
     df[new_column_name] = df[column_numerator] / df[column_denominator]
 
@@ -36,11 +45,263 @@ def apply_zscores(df, zscore_columns):
     z_df = df
     #columns = z_df.columns.drop('NAME')
     #columns = columns.drop('Population')
-    z_df[zscore_columns].apply(stats.zscore)
+    z_df[zscore_columns] = zscore_matrix(get_value_matrix(z_df, zscore_columns)[0])
     return z_df
 
+def get_value_matrix(df, columns=None, ratios=None, dtype=np.float64):
+    """
+    Stacks the value columns and ratio columns into one (rows, columns) float matrix.
+
+    :param columns: (list) Columns used as is
+    :param ratios: (dict) {name: (numerator column, denominator column)}; division by zero gives NaN
+    :return: (ndarray, list) The matrix and the names of its columns
+    """
+    columns = list(columns or [])
+    ratios = ratios or {}
+    matrix = np.empty((len(df), len(columns) + len(ratios)), dtype=dtype)
+    for i, column in enumerate(columns):
+        matrix[:, i] = pd.to_numeric(df[column]).to_numpy(dtype=dtype, na_value=np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, (numerator, denominator) in enumerate(ratios.values(), start=len(columns)):
+            matrix[:, i] = (pd.to_numeric(df[numerator]).to_numpy(dtype=dtype, na_value=np.nan)
+                            / pd.to_numeric(df[denominator]).to_numpy(dtype=dtype, na_value=np.nan))
+    matrix[~np.isfinite(matrix)] = np.nan
+    return matrix, columns + list(ratios)
+
+def get_group_codes(df, group_by):
+    """Returns (codes, number of groups) with code -1 for rows with a missing group key."""
+    codes = df.groupby(group_by, sort=False, observed=True, dropna=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    return codes, int(codes.max(initial=-1)) + 1
+
+def zscore_matrix(matrix, codes=None, n_groups=1, ddof=0):
+    """
+    Standardizes every column of the matrix, within each group when group codes are given.
+    NaN values are ignored in the moments and stay NaN; constant columns (or groups) give NaN.
+    """
+    if codes is None:
+        codes = np.zeros(len(matrix), dtype=np.int64)
+    z = np.full(matrix.shape, np.nan, dtype=matrix.dtype)
+    for j in range(matrix.shape[1]):
+        values = matrix[:, j]
+        valid = ~np.isnan(values) & (codes >= 0)
+        group = codes[valid]
+        counts = np.bincount(group, minlength=n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.bincount(group, values[valid], minlength=n_groups) / counts
+            deviations = values[valid] - means[group]
+            stds = np.sqrt(np.bincount(group, deviations * deviations, minlength=n_groups) / (counts - ddof))
+            stds[stds == 0] = np.nan
+            z[valid, j] = deviations / stds[group]
+    return z
+
+def quantile_bins(values, bins=DEFAULT_BINS):
+    """Returns (bin index per value with -1 for NaN, bin edges) for equal count quantile bins."""
+    edges = np.nanquantile(values, np.linspace(0, 1, bins + 1))
+    labels = np.searchsorted(edges[1:-1], values, side='right').astype(np.int8)
+    labels[np.isnan(values)] = -1
+    return labels, edges
+
+def composite_index(df, columns=None, ratios=None, weights=None, group_by=None, bins=DEFAULT_BINS, dtype=np.float64, ddof=0):
+    """
+    Scores rows by the weighted sum of the z-scores of several columns in one pass over a float matrix.
+
+    :param df: (DataFrame) Census result, e.g. one row per tract
+    :param columns: (list) Columns standardized as is
+    :param ratios: (dict) {name: (numerator, denominator)} ratio columns computed without adding them to df
+    :param weights: (dict) {column or ratio name: weight} (default: 1 for every column)
+    :param group_by: (str|list) Standardize within groups, e.g. 'state'
+    :param bins: (int) Number of quantile bins of the composite score
+    :param dtype: (type) np.float32 or np.float64
+    :return: (DataFrame) Z-<name> per input, Z-SUM (NaN only when every input is NaN) and Z-BIN (-1 for NaN)
+    """
+    matrix, names = get_value_matrix(df, columns, ratios, dtype)
+    if group_by is None:
+        z = zscore_matrix(matrix, ddof=ddof)
+    else:
+        codes, n_groups = get_group_codes(df, group_by)
+        z = zscore_matrix(matrix, codes, n_groups, ddof)
+    weights = weights or {}
+    weight_vector = np.array([weights.get(name, 1) for name in names], dtype=dtype)
+    missing = np.isnan(z)
+    score = np.where(missing, 0, z) @ weight_vector
+    score[missing.all(axis=1)] = np.nan
+    labels, edges = quantile_bins(score, bins)
+    result = pd.DataFrame(z, index=df.index, columns=[f"Z-{name}" for name in names])
+    result['Z-SUM'] = score
+    result['Z-BIN'] = labels
+    result.attrs['bin_edges'] = edges
+    return result
+
 def set_table_data_types(df, columns, type):  #input dict with label -> data_type mappings?
     for var_name in columns:
         set_column_data_type(df, var_name, type)
 def set_column_data_type(df, var_name, type):
     df[var_name] = df[var_name].astype(type)
+
+
+
+def clean_moe(moe):
+    """Returns margins of error as floats with controlled MOEs as 0 and the other annotation values as NaN."""
+    moe = np.array(moe, dtype=np.float64)
+    moe[moe == CONTROLLED_MOE] = 0
+    moe[np.isin(moe, CENSUS_SENTINELS)] = np.nan
+    return moe
+
+def moe_sum(moes, estimates=None, axis=-1):
+    """
+    MOE of a sum of estimates: the root of the summed squared MOEs. With the estimates given,
+    only the largest MOE of the zero estimates is included, as the Census guidance recommends.
+
+    :param moes: (array) MOEs of the summed estimates along axis, e.g. (rows, estimates)
+    """
+    moes = clean_moe(moes)
+    squares = moes * moes
+    if estimates is None:
+        return np.sqrt(squares.sum(axis=axis))
+    zero = np.asarray(estimates) == 0
+    largest_zero = np.where(zero, squares, -np.inf).max(axis=axis)
+    total = np.where(zero, 0, squares).sum(axis=axis)
+    return np.sqrt(total + np.where(np.isinf(largest_zero), 0, largest_zero))
+
+def moe_ratio(numerator, denominator, moe_numerator, moe_denominator):
+    """MOE of numerator / denominator when the numerator is not a subset of the denominator."""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    moe_numerator = clean_moe(moe_numerator)
+    moe_denominator = clean_moe(moe_denominator)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / denominator
+        moe = np.sqrt(moe_numerator ** 2 + ratio ** 2 * moe_denominator ** 2) / denominator
+    return np.where(np.isfinite(moe), moe, np.nan)
+
+def moe_proportion(numerator, denominator, moe_numerator, moe_denominator):
+    """
+    MOE of numerator / denominator when the numerator is a subset of the denominator.
+    Where the value under the root is negative the ratio formula is used instead.
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    moe_numerator = clean_moe(moe_numerator)
+    moe_denominator = clean_moe(moe_denominator)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportion = numerator / denominator
+        radicand = moe_numerator ** 2 - proportion ** 2 * moe_denominator ** 2
+        radicand = np.where(radicand < 0, moe_numerator ** 2 + proportion ** 2 * moe_denominator ** 2, radicand)
+        moe = np.sqrt(radicand) / denominator
+    return np.where(np.isfinite(moe), moe, np.nan)
+
+def coefficient_of_variation(estimate, moe):
+    """Standard error over the estimate, the usual reliability measure for ACS estimates."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return clean_moe(moe) / MOE_Z / np.abs(np.asarray(estimate, dtype=np.float64))
+
+def get_moe_name(column):
+    return get_moe_variable(column) or f"{column}_M"
+
+def get_moe_columns(columns):
+    """Pairs each estimate column with its margin of error column: {estimate: moe}."""
+    columns = list(columns)
+    return {column: get_moe_name(column) for column in columns if get_moe_name(column) in columns}
+
+def get_moe_matrix(df, columns):
+    pairs = get_moe_columns(df.columns)
+    missing = [column for column in columns if column not in pairs]
+    if missing:
+        raise ValueError(f"No margin of error columns for: {', '.join(missing)}")
+    return (get_value_matrix(df, columns)[0],
+            clean_moe(get_value_matrix(df, [pairs[column] for column in columns])[0]))
+
+def add_sums_with_moe(df, sums):
+    """
+    Adds summed estimates and their MOEs (as <name>_M) to df.
+
+    :param sums: (dict) {new column: [estimate columns]}
+    """
+    for name, columns in sums.items():
+        estimates, moes = get_moe_matrix(df, columns)
+        df[name] = estimates.sum(axis=1)
+        df[get_moe_name(name)] = moe_sum(moes, estimates)
+    return df
+
+def add_ratios_with_moe(df, ratios, proportion=False):
+    """
+    Adds ratio (or proportion) columns and their MOEs (as <name>_M) to df, computing all of them at once.
+
+    :param ratios: (dict) {new column: (numerator column, denominator column)}
+    :param proportion: (bool) Numerators are subsets of their denominators (e.g. poverty / population)
+    """
+    numerators, moe_numerators = get_moe_matrix(df, [numerator for numerator, denominator in ratios.values()])
+    denominators, moe_denominators = get_moe_matrix(df, [denominator for numerator, denominator in ratios.values()])
+    moe_function = moe_proportion if proportion else moe_ratio
+    moes = moe_function(numerators, denominators, moe_numerators, moe_denominators)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = numerators / denominators
+    values[~np.isfinite(values)] = np.nan
+    for i, name in enumerate(ratios):
+        df[name] = values[:, i]
+        df[get_moe_name(name)] = moes[:, i]
+    return df
+
+
+class MyTestCase(unittest.TestCase):
+    df = pd.DataFrame({'state': ['17', '17', '17', '18', '18', '18'],
+                       'poverty': [10, 20, 30, 5, 5, 20],
+                       'population': [100, 100, 100, 50, 0, 100],
+                       'income': [50.0, 40.0, np.nan, 70.0, 60.0, 50.0]})
+
+    def test_composite_matches_scipy(self):
+        result = composite_index(self.df, columns=['income'], ratios={'poverty_rate': ('poverty', 'population')},
+                                 weights={'income': -1})
+        rate = (self.df['poverty'] / self.df['population']).replace(np.inf, np.nan)
+        np.testing.assert_allclose(stats.zscore(rate, nan_policy='omit'), result['Z-poverty_rate'])
+        np.testing.assert_allclose(stats.zscore(self.df['income'], nan_policy='omit'), result['Z-income'])
+        expected = result['Z-poverty_rate'].fillna(0) - result['Z-income'].fillna(0)
+        np.testing.assert_allclose(expected, result['Z-SUM'])
+        self.assertEqual(3, len(result.attrs['bin_edges']) - 1)
+        self.assertEqual(2, result['Z-BIN'][result['Z-SUM'].idxmax()])
+
+    def test_grouped_zscores(self):
+        result = composite_index(self.df, columns=['poverty'], group_by='state', dtype=np.float32)
+        self.assertEqual(np.float32, result['Z-poverty'].dtype)
+        np.testing.assert_allclose(stats.zscore([10, 20, 30]), result['Z-poverty'][:3], rtol=1e-6)
+        np.testing.assert_allclose(stats.zscore([5, 5, 20]), result['Z-poverty'][3:], rtol=1e-6)
+
+    def test_missing_group_key(self):
+        df = self.df.astype({'state': object})
+        df.loc[5, 'state'] = None
+        self.assertEqual([0, 0, 0, 1, 1, -1], list(get_group_codes(df, 'state')[0]))
+        result = composite_index(df, columns=['poverty'], group_by='state')
+        np.testing.assert_allclose(stats.zscore([10, 20, 30]), result['Z-poverty'][:3])
+        self.assertTrue(np.isnan(result['Z-poverty'][5]))
+        self.assertEqual(-1, result['Z-BIN'][5])
+        self.assertEqual(0, get_group_codes(df.iloc[:0], 'state')[1])
+
+    def test_apply_zscores_assigns(self):
+        df = apply_zscores(self.df.copy(), ['poverty'])
+        np.testing.assert_allclose(stats.zscore(self.df['poverty']), df['poverty'])
+
+    def test_moe_formulas(self):
+        # Worked examples from the Census Bureau's ACS handbook
+        self.assertAlmostEqual(np.sqrt(3 ** 2 + 4 ** 2), moe_sum([[3, 4]])[0])
+        self.assertAlmostEqual(np.sqrt(3 ** 2 + 5 ** 2), moe_sum([[3, 4, 5]], [[10, 0, 0]])[0])
+        self.assertAlmostEqual(np.sqrt(40 ** 2 - 0.25 ** 2 * 60 ** 2) / 400, moe_proportion(100, 400, 40, 60)[()])
+        self.assertAlmostEqual(np.sqrt(40 ** 2 + 0.25 ** 2 * 200 ** 2) / 400, moe_proportion(100, 400, 40, 200)[()])
+        self.assertAlmostEqual(np.sqrt(40 ** 2 + 0.25 ** 2 * 60 ** 2) / 400, moe_ratio(100, 400, 40, 60)[()])
+        self.assertEqual(0, clean_moe([-555555555])[0])
+
+    def test_moe_columns(self):
+        df = pd.DataFrame({'B17001_002E': [100, 0], 'B17001_002M': [40, 12],
+                           'B17001_001E': [400, 0], 'B17001_001M': [60, -555555555],
+                           'B01001_001E': [500, 10]})
+        self.assertEqual({'B17001_002E': 'B17001_002M', 'B17001_001E': 'B17001_001M'}, get_moe_columns(df.columns))
+        add_ratios_with_moe(df, {'poverty_rate': ('B17001_002E', 'B17001_001E')}, proportion=True)
+        self.assertAlmostEqual(0.25, df['poverty_rate'][0])
+        self.assertAlmostEqual(moe_proportion(100, 400, 40, 60)[()], df['poverty_rate_M'][0])
+        self.assertTrue(pd.isna(df['poverty_rate'][1]))
+        add_sums_with_moe(df, {'total': ['B17001_002E', 'B17001_001E']})
+        self.assertAlmostEqual(12, df['total_M'][1])
+        with self.assertRaises(ValueError):
+            add_sums_with_moe(df, {'total': ['B01001_001E']})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy import stats
+
+DEFAULT_SKETCH_SIZE = 200
+DEFAULT_BATCH_SIZE = 1 << 20
+MAX_WORKERS = 4
+
+
+def get_chunks(chunks):
+    """Chunks may be an iterable or a callable returning a fresh iterator (needed for two-pass statistics)."""
+    return chunks() if callable(chunks) else iter(chunks)
+
+def check_two_pass(chunks):
+    """Two-pass statistics need chunks that can be read again: a callable or a re-iterable such as a list."""
+    if callable(chunks) or (isinstance(chunks, Iterable) and not isinstance(chunks, Iterator)):
+        return chunks
+    raise TypeError("Two-pass statistics read the chunks twice; pass a callable returning a fresh iterator or a list, not an iterator")
+
+def get_chunk_seed(seed, i):
+    """Each chunk's sketch gets its own seed so the compaction coin flips differ between chunks."""
+    return None if seed is None else seed + i
+
+def iter_parquet_chunks(path, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields a parquet file as DataFrame chunks of at most batch_size rows."""
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+def map_chunks(func, chunks, max_workers=MAX_WORKERS):
+    """Applies func to every chunk on a thread pool, yielding results in order with at most max_workers chunks in flight."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for chunk in get_chunks(chunks):
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def get_chunk_matrix(chunk, columns):
+    return chunk[columns].apply(pd.to_numeric).to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+class runningMoments():
+    """Count, mean and sum of squared deviations per column, updated with Welford/Chan merges."""
+
+    def __init__(self, n_columns):
+        self.count = np.zeros(n_columns)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+
+    def combine(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta * delta * self.count * count / total, 0)
+        self.count = total
+
+    def update(self, matrix):
+        """Adds a (rows, columns) chunk, ignoring NaN."""
+        valid = ~np.isnan(matrix)
+        count = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, np.where(valid, matrix, 0).sum(axis=0) / count, 0)
+        deviations = np.where(valid, matrix - mean, 0)
+        self.combine(count, mean, (deviations * deviations).sum(axis=0))
+        return self
+
+    def merge(self, other):
+        self.combine(other.count, other.mean, other.m2)
+        return self
+
+    def variance(self, ddof=0):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.variance(ddof))
+
+
+class kllSketch():
+    """
+    Mergeable KLL quantile sketch of one column.
+
+    Items live in levels of compactors; level h items weigh 2**h. A level over
+    its capacity is sorted and every other item (random offset) moves up a
+    level, so memory stays O(k) and the rank error is about 1.7/k.
+    """
+
+    def __init__(self, k=DEFAULT_SKETCH_SIZE, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                leftover = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[self.rng.integers(2)::2]])
+                self.levels[level] = leftover
+            level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def get_count(self):
+        return sum(len(items) << level for level, items in enumerate(self.levels))
+
+    def quantile(self, quantiles):
+        """Returns the approximate values at the quantiles (exact min and max at 0 and 1)."""
+        quantiles = np.atleast_1d(np.asarray(quantiles, dtype=np.float64))
+        items = np.concatenate(self.levels)
+        if not len(items):
+            return np.full(len(quantiles), np.nan)
+        weights = np.concatenate([np.full(len(items), 1 << level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, quantiles * cumulative[-1], side='left')
+        values = items[order][np.minimum(positions, len(items) - 1)]
+        values[quantiles <= 0] = self.min
+        values[quantiles >= 1] = self.max
+        return values
+
+
+class columnStats():
+    """Running moments and a quantile sketch for each of several columns."""
+
+    def __init__(self, columns, k=DEFAULT_SKETCH_SIZE, seed=None):
+        self.columns = list(columns)
+        self.moments = runningMoments(len(self.columns))
+        self.sketches = [kllSketch(k, seed) for column in self.columns]
+
+    def update(self, chunk):
+        matrix = get_chunk_matrix(chunk, self.columns)
+        self.moments.update(matrix)
+        for i, sketch in enumerate(self.sketches):
+            sketch.update(matrix[:, i])
+        return self
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    def get_count(self):
+        return pd.Series(self.moments.count.astype(np.int64), index=self.columns)
+
+    def get_mean(self):
+        return pd.Series(self.moments.mean, index=self.columns)
+
+    def get_std(self, ddof=0):
+        return pd.Series(self.moments.std(ddof), index=self.columns)
+
+    def get_quantiles(self, quantiles):
+        """Returns a (quantile, column) DataFrame like DataFrame.quantile."""
+        quantiles = list(np.atleast_1d(quantiles))
+        return pd.DataFrame({column: sketch.quantile(quantiles) for column, sketch in zip(self.columns, self.sketches)}, index=quantiles)
+
+
+def collect_stats(chunks, columns, k=DEFAULT_SKETCH_SIZE, max_workers=MAX_WORKERS, seed=None):
+    """
+    Computes moments and quantile sketches of the columns over chunks in parallel.
+
+    :param chunks: (iterable|callable) DataFrame chunks, e.g. iter_parquet_chunks(path)
+    :param columns: (list) Numeric columns
+    :param k: (int) Sketch size; larger is more accurate
+    :return: (columnStats) Merged statistics of every chunk
+    """
+    def chunk_stats(item):
+        i, chunk = item
+        return columnStats(columns, k, get_chunk_seed(seed, i + 1)).update(chunk)
+    result = columnStats(columns, k, seed)
+    for stats_of_chunk in map_chunks(chunk_stats, enumerate(get_chunks(chunks)), max_workers):
+        result.merge(stats_of_chunk)
+    return result
+
+def stream_quantile_values(chunks, column_name, quantiles, k=DEFAULT_SKETCH_SIZE, max_workers=MAX_WORKERS):
+    """Out-of-core get_quantile_values: approximate quantiles of one column over chunks."""
+    return collect_stats(chunks, [column_name], k, max_workers).get_quantiles(quantiles)[column_name]
+
+def iter_zscores(chunks, columns, column_stats=None, max_workers=MAX_WORKERS):
+    """
+    Yields chunks with their columns replaced by global z-scores. Without precomputed
+    statistics the chunks are read twice, so chunks must then be a callable.
+    """
+    if column_stats is None:
+        column_stats = collect_stats(check_two_pass(chunks), columns, max_workers=max_workers)
+    mean = column_stats.get_mean()[columns].to_numpy()
+    std = column_stats.get_std()[columns].to_numpy()
+
+    def standardize(chunk):
+        chunk = chunk.copy()
+        chunk[columns] = (get_chunk_matrix(chunk, columns) - mean) / std
+        return chunk
+    yield from map_chunks(standardize, chunks, max_workers)
+
+def filter_outliers(chunks, column_variable, std_dev=3, max_workers=MAX_WORKERS):
+    """
+    Two-pass out-of-core remove_outliers_from_column_by_std_dev: the first pass computes the
+    column's mean and std, the second yields each chunk without rows |z| >= std_dev.
+
+    :param chunks: (callable|list) Returns a fresh iterator of DataFrame chunks for each pass (iterators raise TypeError)
+    """
+    column_stats = collect_stats(check_two_pass(chunks), [column_variable], max_workers=max_workers)
+    mean = column_stats.get_mean()[column_variable]
+    std = column_stats.get_std()[column_variable]
+
+    def keep_inliers(chunk):
+        values = get_chunk_matrix(chunk, [column_variable])[:, 0]
+        return chunk[np.abs((values - mean) / std) < std_dev]
+    yield from map_chunks(keep_inliers, chunks, max_workers)
+
+
+class MyTestCase(unittest.TestCase):
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame({'P001001': rng.lognormal(4, 1, 100000), 'P001002': rng.normal(50, 10, 100000)})
+    df.loc[::97, 'P001002'] = np.nan
+
+    def get_chunks(self):
+        return (self.df.iloc[start:start + 7000] for start in range(0, len(self.df), 7000))
+
+    def test_moments(self):
+        column_stats = collect_stats(self.get_chunks, ['P001001', 'P001002'], seed=1)
+        np.testing.assert_allclose(self.df.mean(), column_stats.get_mean())
+        np.testing.assert_allclose(self.df.std(ddof=0), column_stats.get_std())
+        self.assertEqual(self.df['P001002'].count(), column_stats.get_count()['P001002'])
+
+    def test_quantile_sketch(self):
+        quantiles = stream_quantile_values(self.get_chunks, 'P001001', [0, 0.1, 0.5, 0.9, 1])
+        ranks = stats.percentileofscore(self.df['P001001'], quantiles) / 100
+        np.testing.assert_allclose([0, 0.1, 0.5, 0.9, 1], ranks, atol=0.02)
+        self.assertEqual(self.df['P001001'].max(), quantiles[1])
+
+    def test_filter_outliers(self):
+        expected = self.df[np.abs(stats.zscore(self.df['P001002'], nan_policy='omit')) < 2]
+        filtered = pd.concat(filter_outliers(self.get_chunks, 'P001002', std_dev=2))
+        self.assertTrue(expected.equals(filtered))
+
+    def test_two_pass_needs_reiterable_chunks(self):
+        with self.assertRaises(TypeError):
+            list(filter_outliers(self.get_chunks(), 'P001002'))
+        with self.assertRaises(TypeError):
+            list(iter_zscores(iter(list(self.get_chunks())), ['P001002']))
+        self.assertEqual(len(self.df), sum(len(chunk) for chunk in iter_zscores(list(self.get_chunks()), ['P001002'])))
+
+    def test_chunk_seeds_differ(self):
+        seeds = []
+
+        class recordingStats(columnStats):
+            def __init__(self, columns, k=DEFAULT_SKETCH_SIZE, seed=None):
+                seeds.append(seed)
+                super().__init__(columns, k, seed)
+        with mock.patch.object(sys.modules[__name__], 'columnStats', recordingStats):
+            collect_stats(self.get_chunks, ['P001001'], seed=5)
+        self.assertEqual(len(seeds), len(set(seeds)))
+
+    def test_parquet_chunks(self):
+        path = os.path.join(tempfile.mkdtemp(), 'blocks.parquet')
+        self.df.to_parquet(path)
+        chunks = list(iter_parquet_chunks(path, ['P001001'], batch_size=30000))
+        self.assertEqual([30000, 30000, 30000, 10000], [len(chunk) for chunk in chunks])
+        z = pd.concat(iter_zscores(lambda: iter_parquet_chunks(path, batch_size=30000), ['P001001']))
+        np.testing.assert_allclose(stats.zscore(self.df['P001001']), z['P001001'])
+        shutil.rmtree(os.path.dirname(path))
+
+if __name__ == '__main__':
+    unittest.main()
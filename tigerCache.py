@@ -0,0 +1,369 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+import shapely
+from shapely.geometry import box
+
+from censusCache import DEFAULT_CACHE_DIR
+from httpUtils import download_file
+
+TIGER_URL = 'https://www2.census.gov/geo/tiger'
+DEFAULT_TIGER_DIR = os.path.join(DEFAULT_CACHE_DIR, 'tiger')
+
+# layer -> (directory, file suffix); 2010 files live in a vintage sub directory with a 10 suffix
+TIGER_LAYERS_2010 = {'tabblock': ('TABBLOCK/2010', 'tabblock10'),
+                     'bg': ('BG/2010', 'bg10'),
+                     'tract': ('TRACT/2010', 'tract10'),
+                     'county': ('COUNTY/2010', 'county10'),
+                     'state': ('STATE/2010', 'state10'),
+                     'place': ('PLACE/2010', 'place10'),
+                     'cbsa': ('CBSA/2010', 'cbsa10'),
+                     'csa': ('CSA/2010', 'csa10')}
+TIGER_LAYERS = {'tabblock': ('TABBLOCK20', 'tabblock20'),
+                'bg': ('BG', 'bg'),
+                'tract': ('TRACT', 'tract'),
+                'county': ('COUNTY', 'county'),
+                'state': ('STATE', 'state'),
+                'place': ('PLACE', 'place'),
+                'cbsa': ('CBSA', 'cbsa'),
+                'csa': ('CSA', 'csa')}
+# Census blocks are only redrawn every decennial census, so between censuses the block files keep
+# the previous census' layout: (first vintage, directory, suffix), latest first
+TABBLOCK_LAYERS = ((2020, 'TABBLOCK20', 'tabblock20'),
+                   (2014, 'TABBLOCK', 'tabblock10'),
+                   (2011, 'TABBLOCK', 'tabblock'))
+
+
+STATE_FIELDS = ('STATEFP', 'STATEFP10', 'STATEFP20')
+GEOID_FIELDS = ('GEOID', 'GEOID10', 'GEOID20')
+ROW_GROUP_SIZE = 10000
+# Simplification levels in layer units (degrees for TIGER's NAD83), from finest to coarsest
+SIMPLIFY_TOLERANCES = (0.00005, 0.0002, 0.001, 0.005)
+DEFAULT_FIGSIZE = (12, 10)
+DEFAULT_DPI = 100
+
+
+def get_tiger_area(state=None, county=None):
+    if county:
+        return f"{state}{county}"
+    return state or 'us'
+
+def get_tiger_layer(vintage, layer):
+    """Returns the (directory, file suffix) of a layer in a vintage."""
+    vintage = int(vintage)
+    if vintage == 2010:
+        return TIGER_LAYERS_2010[layer]
+    if layer == 'tabblock':
+        for first_vintage, directory, suffix in TABBLOCK_LAYERS:
+            if vintage >= first_vintage:
+                return directory, suffix
+        raise ValueError(f"No TIGER/Line block layer for {vintage}")
+    return TIGER_LAYERS[layer]
+
+def get_tiger_name(vintage, layer, state=None, county=None):
+    """Returns the TIGER/Line file name without extension, e.g. tl_2010_17031_tabblock10."""
+    directory, suffix = get_tiger_layer(vintage, layer)
+    return f"tl_{vintage}_{get_tiger_area(state, county)}_{suffix}"
+
+def get_tiger_url(vintage, layer, state=None, county=None):
+    directory, suffix = get_tiger_layer(vintage, layer)
+    return f"{TIGER_URL}/TIGER{vintage}/{directory}/{get_tiger_name(vintage, layer, state, county)}.zip"
+
+def read_zipped_shapefile(zip_path, shapefile_name=None, **kwargs):
+    """Reads a shapefile straight out of its zip archive without extracting it."""
+    if shapefile_name is None:
+        with zipfile.ZipFile(zip_path) as zip_ref:
+            shapefile_name = next(name for name in zip_ref.namelist() if name.endswith('.shp'))
+    return gpd.read_file(f"/vsizip/{os.path.abspath(zip_path)}/{shapefile_name}", **kwargs)
+
+def get_filter_values(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+def quote_value(value):
+    value = str(value).replace("'", "''")
+    return f"'{value}'"
+
+def build_where(filters):
+    """Turns {field: value or [values]} into the SQL where clause GDAL evaluates while reading."""
+    if not filters:
+        return None
+    clauses = []
+    for field, value in filters.items():
+        values = get_filter_values(value)
+        if len(values) == 1:
+            clauses.append(f"{field} = {quote_value(values[0])}")
+        else:
+            clauses.append(f"{field} IN ({', '.join(quote_value(v) for v in values)})")
+    return ' AND '.join(clauses)
+
+def build_parquet_filters(filters):
+    if not filters:
+        return None
+    return [(field, 'in', get_filter_values(value)) for field, value in filters.items()]
+
+def get_read_columns(columns, filters):
+    """Filter fields have to be read for the filter to be evaluated, even when they are not requested."""
+    if columns is None:
+        return None, []
+    extra_columns = [field for field in (filters or {}) if field not in columns]
+    return list(columns) + extra_columns, extra_columns
+
+def write_tiger_parquet(gdf, path):
+    """Writes a layer sorted by GEOID in small row groups with a bbox column, so filtered reads can skip row groups."""
+    geoid_field = next((field for field in GEOID_FIELDS if field in gdf.columns), None)
+    if geoid_field:
+        gdf = gdf.sort_values(geoid_field, ignore_index=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    gdf.to_parquet(f"{path}.tmp", index=False, write_covering_bbox=True, row_group_size=ROW_GROUP_SIZE)
+    os.replace(f"{path}.tmp", path)
+
+def read_tiger_parquet(path, filters=None, bbox=None, columns=None):
+    """Reads a stored layer, pushing attribute filters and the bbox down to the parquet reader."""
+    columns, extra_columns = get_read_columns(columns, filters)
+    if columns is not None and 'geometry' not in columns:
+        columns.append('geometry')
+    kwargs = {'filters': build_parquet_filters(filters)} if filters else {}
+    try:
+        gdf = gpd.read_parquet(path, columns=columns, bbox=bbox, **kwargs)
+    except ValueError:
+        # written without the bbox covering column
+        gdf = gpd.read_parquet(path, columns=columns, **kwargs)
+        gdf = gdf.cx[bbox[0]:bbox[2], bbox[1]:bbox[3]]
+    return gdf.drop(columns=extra_columns)
+
+def read_filtered_shapefile(zip_path, shapefile_name, filters=None, bbox=None, columns=None):
+    """Reads a subset of a zipped shapefile, with GDAL evaluating the filters and bbox during the read."""
+    columns, extra_columns = get_read_columns(columns, filters)
+    gdf = read_zipped_shapefile(zip_path, shapefile_name, where=build_where(filters), bbox=bbox, columns=columns)
+    return gdf.drop(columns=extra_columns)
+
+def get_parquet_bounds(path):
+    """Reads the layer bounds from the GeoParquet metadata without loading any geometry."""
+    metadata = json.loads(pq.read_metadata(path).metadata[b'geo'])
+    return metadata['columns'][metadata['primary_column']]['bbox']
+
+def simplify_geometry(geometry, tolerance):
+    """
+    Simplifies a layer's polygons while keeping shared edges shared, so adjacent
+    blocks/tracts neither overlap nor open gaps. Falls back to per-polygon
+    topology preserving simplification for non-polygonal layers.
+    """
+    if geometry.geom_type.isin(['Polygon', 'MultiPolygon']).all():
+        simplified = shapely.coverage_simplify(geometry.values, tolerance)
+        return gpd.GeoSeries(simplified, index=geometry.index, crs=geometry.crs)
+    return geometry.simplify(tolerance, preserve_topology=True)
+
+def pick_tolerance(bounds, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI, tolerances=SIMPLIFY_TOLERANCES):
+    """Returns the coarsest tolerance still below one output pixel, or None when full detail is needed."""
+    minx, miny, maxx, maxy = bounds
+    pixel_size = min((maxx - minx) / (figsize[0] * dpi), (maxy - miny) / (figsize[1] * dpi))
+    usable = [tolerance for tolerance in tolerances if tolerance <= pixel_size]
+    return max(usable) if usable else None
+
+
+class tigerCache():
+    """
+    Local cache of TIGER/Line layers keyed by (vintage, layer, state, county).
+
+    The zip is downloaded once and read in place. The first load also writes the
+    layer as GeoParquet (geometry stored as WKB), which every later load reads instead.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_TIGER_DIR):
+        self.cache_dir = cache_dir
+
+    def get_zip_path(self, vintage, layer, state=None, county=None):
+        return os.path.join(self.cache_dir, str(vintage), f"{get_tiger_name(vintage, layer, state, county)}.zip")
+
+    def get_parquet_path(self, vintage, layer, state=None, county=None):
+        return os.path.join(self.cache_dir, str(vintage), f"{get_tiger_name(vintage, layer, state, county)}.parquet")
+
+    def get_simplified_path(self, vintage, layer, state=None, county=None, tolerance=SIMPLIFY_TOLERANCES[0]):
+        return os.path.join(self.cache_dir, str(vintage), f"{get_tiger_name(vintage, layer, state, county)}.simplified-{tolerance:g}.parquet")
+
+    def get_shard_path(self, vintage, layer, state_field, statefp):
+        return os.path.join(self.cache_dir, str(vintage), get_tiger_name(vintage, layer), f"{state_field}={statefp}.parquet")
+
+    def find_shard(self, vintage, layer, filters):
+        """Returns (shard path, remaining filters) when filters select a single state that has been sharded."""
+        for field in STATE_FIELDS:
+            values = get_filter_values(filters.get(field, [])) if filters else []
+            if len(values) == 1:
+                path = self.get_shard_path(vintage, layer, field, values[0])
+                if os.path.exists(path):
+                    return path, {key: value for key, value in filters.items() if key != field}
+        return None, filters
+
+    def shard_by_state(self, vintage, layer):
+        """Writes one parquet file per state for a national layer so single-state loads read only that state."""
+        gdf = self.load(vintage, layer)
+        state_field = next((field for field in STATE_FIELDS if field in gdf.columns), None)
+        if state_field is None:
+            raise ValueError(f"Layer {layer} has no state field to shard on")
+        paths = []
+        for statefp, state_gdf in gdf.groupby(state_field):
+            path = self.get_shard_path(vintage, layer, state_field, statefp)
+            write_tiger_parquet(state_gdf, path)
+            paths.append(path)
+        return paths
+
+    def download(self, vintage, layer, state=None, county=None, url=None):
+        zip_path = self.get_zip_path(vintage, layer, state, county)
+        if not os.path.exists(zip_path):
+            os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+            url = url or get_tiger_url(vintage, layer, state, county)
+            print(f"Downloading {url}...")
+            download_file(url, zip_path)
+        return zip_path
+
+    def load(self, vintage, layer, state=None, county=None, url=None, refresh=False, filters=None, bbox=None, columns=None):
+        """
+        :param vintage: (int) TIGER/Line vintage, e.g. 2010 or 2022
+        :param layer: (str) One of TIGER_LAYERS (tabblock, bg, tract, county, state, place, cbsa, csa)
+        :param state: (str) State FIPS code for state based files
+        :param county: (str) County FIPS code for county based files
+        :param url: (str) Override for the download url
+        :param refresh: (bool) Rebuild the parquet copy from the zip
+        :param filters: (dict) {field: value or [values]} pushed down to the read, e.g. {'STATEFP': '48'}
+        :param bbox: (tuple) (minx, miny, maxx, maxy) in the layer's crs; only intersecting features are read
+        :param columns: (list) Attribute columns to read (default: all)
+        :return: (GeoDataFrame) The layer
+        """
+        parquet_path = self.get_parquet_path(vintage, layer, state, county)
+        if not refresh and state is None and filters:
+            shard_path, shard_filters = self.find_shard(vintage, layer, filters)
+            if shard_path:
+                return read_tiger_parquet(shard_path, shard_filters, bbox, columns)
+        if not refresh and os.path.exists(parquet_path):
+            return read_tiger_parquet(parquet_path, filters, bbox, columns)
+        zip_path = self.download(vintage, layer, state, county, url)
+        shapefile_name = f"{get_tiger_name(vintage, layer, state, county)}.shp"
+        if filters or bbox or columns:
+            # A subset is returned straight from the zip and not stored as the layer's parquet copy
+            return read_filtered_shapefile(zip_path, shapefile_name, filters, bbox, columns)
+        gdf = read_zipped_shapefile(zip_path, shapefile_name)
+        write_tiger_parquet(gdf, parquet_path)
+        return gdf
+
+    def build_simplified(self, vintage, layer, state=None, county=None, tolerances=SIMPLIFY_TOLERANCES):
+        """Precomputes and stores the layer at each simplification tolerance, next to the full copy."""
+        gdf = self.load(vintage, layer, state, county)
+        paths = []
+        for tolerance in tolerances:
+            simplified = gdf.set_geometry(simplify_geometry(gdf.geometry, tolerance))
+            path = self.get_simplified_path(vintage, layer, state, county, tolerance)
+            write_tiger_parquet(simplified, path)
+            paths.append(path)
+        return paths
+
+    def load_simplified(self, vintage, layer, state=None, county=None, figsize=DEFAULT_FIGSIZE, dpi=DEFAULT_DPI,
+                        tolerance=None, filters=None, columns=None):
+        """
+        Loads the simplification level matching the output resolution, building the levels on first use.
+
+        :param figsize: (tuple) Figure size in inches the layer is rendered at
+        :param dpi: (int) Output resolution
+        :param tolerance: (float) Explicit level to load instead of picking one from figsize/dpi
+        :return: (GeoDataFrame) The layer with simplified geometry (full geometry if no level is coarse enough)
+        """
+        if tolerance is None:
+            coarsest_path = self.get_simplified_path(vintage, layer, state, county, SIMPLIFY_TOLERANCES[-1])
+            if not os.path.exists(coarsest_path):
+                self.build_simplified(vintage, layer, state, county)
+            if filters:
+                bounds = read_tiger_parquet(coarsest_path, filters, None, []).total_bounds
+            else:
+                bounds = get_parquet_bounds(coarsest_path)
+            tolerance = pick_tolerance(bounds, figsize, dpi)
+        if tolerance is None:
+            return self.load(vintage, layer, state, county, filters=filters, columns=columns)
+        path = self.get_simplified_path(vintage, layer, state, county, tolerance)
+        if not os.path.exists(path):
+            self.build_simplified(vintage, layer, state, county)
+        return read_tiger_parquet(path, filters, None, columns)
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.tiger = tigerCache(self.cache_dir)
+        self.write_tiger_zip(2010, 'tract', '17', '031')
+
+    def write_tiger_zip(self, vintage, layer, state=None, county=None):
+        """Stand-in for a downloaded TIGER zip so the tests run offline."""
+        name = get_tiger_name(vintage, layer, state, county)
+        shp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        gdf = gpd.GeoDataFrame({'STATEFP10': ['17', '17', '18'],
+                                'GEOID10': ['17031010100', '17031010201', '18089010100'],
+                                'NAME10': ['101', "102.01", "O'Hare"]},
+                               geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(5, 5, 6, 6)], crs='EPSG:4269')
+        gdf.to_file(os.path.join(shp_dir, f"{name}.shp"))
+        zip_path = self.tiger.get_zip_path(vintage, layer, state, county)
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        with zipfile.ZipFile(zip_path, 'w') as zip_ref:
+            for file_name in os.listdir(shp_dir):
+                zip_ref.write(os.path.join(shp_dir, file_name), file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_tiger_url(self):
+        self.assertEqual('https://www2.census.gov/geo/tiger/TIGER2010/TABBLOCK/2010/tl_2010_17031_tabblock10.zip',
+                         get_tiger_url(2010, 'tabblock', '17', '031'))
+        self.assertEqual('https://www2.census.gov/geo/tiger/TIGER2022/COUNTY/tl_2022_us_county.zip',
+                         get_tiger_url(2022, 'county'))
+        self.assertEqual('https://www2.census.gov/geo/tiger/TIGER2012/TABBLOCK/tl_2012_17_tabblock.zip',
+                         get_tiger_url(2012, 'tabblock', '17'))
+        self.assertEqual('https://www2.census.gov/geo/tiger/TIGER2019/TABBLOCK/tl_2019_17_tabblock10.zip',
+                         get_tiger_url(2019, 'tabblock', '17'))
+        self.assertEqual('https://www2.census.gov/geo/tiger/TIGER2023/TABBLOCK20/tl_2023_17_tabblock20.zip',
+                         get_tiger_url(2023, 'tabblock', '17'))
+
+    def test_load_writes_parquet(self):
+        gdf = self.tiger.load(2010, 'tract', '17', '031')
+        self.assertEqual(['17031010100', '17031010201', '18089010100'], list(gdf['GEOID10']))
+        self.assertTrue(os.path.exists(self.tiger.get_parquet_path(2010, 'tract', '17', '031')))
+        os.remove(self.tiger.get_zip_path(2010, 'tract', '17', '031'))
+        reloaded = self.tiger.load(2010, 'tract', '17', '031')
+        self.assertTrue(gdf.geom_equals(reloaded).all())
+        self.assertEqual(gdf.crs, reloaded.crs)
+
+    def test_filtered_reads(self):
+        for i in range(2):  # from the zip, then from the stored parquet
+            gdf = self.tiger.load(2010, 'tract', '17', '031', filters={'STATEFP10': '17'})
+            self.assertEqual(['17031010100', '17031010201'], sorted(gdf['GEOID10']))
+            gdf = self.tiger.load(2010, 'tract', '17', '031', filters={'NAME10': ["O'Hare", '101']}, columns=['GEOID10'])
+            self.assertEqual(['17031010100', '18089010100'], sorted(gdf['GEOID10']))
+            gdf = self.tiger.load(2010, 'tract', '17', '031', bbox=(4, 4, 7, 7))
+            self.assertEqual(['18089010100'], list(gdf['GEOID10']))
+            self.tiger.load(2010, 'tract', '17', '031')
+
+    def test_state_shards(self):
+        self.write_tiger_zip(2010, 'tract')
+        self.assertEqual(2, len(self.tiger.shard_by_state(2010, 'tract')))
+        os.remove(self.tiger.get_parquet_path(2010, 'tract'))
+        gdf = self.tiger.load(2010, 'tract', filters={'STATEFP10': '18'})
+        self.assertEqual(['18089010100'], list(gdf['GEOID10']))
+
+    def test_simplified_levels(self):
+        self.assertIsNone(pick_tolerance((0, 0, 0.01, 0.01), figsize=(10, 10), dpi=100))
+        self.assertEqual(0.0002, pick_tolerance((-88.3, 41.4, -87.5, 42.2), figsize=(12, 10), dpi=100))
+        self.assertEqual(4, len(self.tiger.build_simplified(2010, 'tract', '17', '031')))
+        gdf = self.tiger.load_simplified(2010, 'tract', '17', '031', tolerance=0.005)
+        self.assertEqual(3, len(gdf))
+        self.assertTrue(gdf.is_valid.all())
+        self.assertEqual(3, len(self.tiger.load_simplified(2010, 'tract', '17', '031', figsize=(6, 6), dpi=72)))
+        self.assertEqual(1, len(self.tiger.load_simplified(2010, 'tract', '17', '031', filters={'STATEFP10': '18'})))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import re
+import unittest
+from unittest import mock
+from collections import OrderedDict
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from censusVariables import get_variables_key, variable_dicts
+
+INDEX_FIELDS = ('Name', 'Label', 'Concept')
+KEYWORD_FIELDS = ('Label', 'Concept')
+LABEL_SEPARATOR = '!!'
+MAX_CACHED_INDEXES = 8
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def get_string_series(values):
+    """Prefers arrow-backed strings so regex matching runs in compiled code."""
+    try:
+        return pd.Series(values, dtype='string[pyarrow]')
+    except ImportError:
+        return pd.Series(values, dtype=object)
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class variableIndex():
+    """
+    Columnar search index over a variables dict ({key: {'Name', 'Label', 'Concept', ...}}).
+
+    Name/Label/Concept are held as string arrays so a regex is matched against a
+    whole column at once. Keyword queries go through a token inverted index and
+    the Estimate!!Total!!... label paths are split once when the index is built.
+    """
+
+    def __init__(self, variables_dict):
+        self.dict = variables_dict
+        self.keys = list(variables_dict.keys())
+        self.size = len(self.keys)
+        entries = [variables_dict[key] for key in self.keys]
+        self.columns = {field: get_string_series([str(entry.get(field, '')) for entry in entries])
+                        for field in INDEX_FIELDS}
+        self.label_paths = [label.split(LABEL_SEPARATOR) for label in self.columns['Label'].tolist()]
+        self.depths = np.fromiter((len(path) for path in self.label_paths), dtype=np.int16, count=self.size)
+        self.parents = np.array([LABEL_SEPARATOR.join(path[:-1]) for path in self.label_paths], dtype=object)
+        self.tokens = None
+
+    def build_token_index(self):
+        postings = {}
+        for field in KEYWORD_FIELDS:
+            for position, text in enumerate(self.columns[field].tolist()):
+                for token in set(tokenize(text)):
+                    postings.setdefault(token, set()).add(position)
+        self.tokens = {token: np.fromiter(sorted(positions), dtype=np.int64, count=len(positions))
+                       for token, positions in postings.items()}
+
+    def get_entries(self, mask_or_positions):
+        positions = np.flatnonzero(mask_or_positions) if mask_or_positions.dtype == bool else mask_or_positions
+        return {self.keys[position]: self.dict[self.keys[position]] for position in positions}
+
+    def match(self, field, reg_ex):
+        """Returns a boolean mask of entries whose field matches reg_ex (case-insensitive search)."""
+        column = self.columns[field]
+        try:
+            mask = column.str.contains(reg_ex, case=False, regex=True)
+        except (re.error, ValueError):
+            # Arrow uses RE2, which lacks some Python regex features (e.g. lookarounds) and raises ArrowInvalid, a ValueError
+            mask = column.astype(object).str.contains(reg_ex, flags=re.IGNORECASE, regex=True)
+        return mask.fillna(False).to_numpy(dtype=bool)
+
+    def search(self, field, reg_ex):
+        return self.get_entries(self.match(field, reg_ex))
+
+    def search_keywords(self, keywords):
+        """Returns the entries whose Label or Concept contain every keyword."""
+        if self.tokens is None:
+            self.build_token_index()
+        tokens = tokenize(keywords) if isinstance(keywords, str) else [token for word in keywords for token in tokenize(word)]
+        if not tokens:
+            return {}
+        postings = [self.tokens.get(token, np.empty(0, dtype=np.int64)) for token in tokens]
+        return self.get_entries(reduce(np.intersect1d, postings))
+
+    def get_totals(self):
+        return self.get_entries((self.columns['Label'] == 'Estimate!!Total').fillna(False).to_numpy(dtype=bool))
+
+    def get_children(self, label):
+        """Returns the entries one level below the given label path."""
+        return self.get_entries(self.parents == label)
+
+    def get_depth(self, key):
+        return int(self.depths[self.keys.index(key)])
+
+indexes = OrderedDict()
+
+def get_variable_index(variables_dict):
+    """
+    Returns the index for a variables dict. Dicts from censusVariables.get_variables_dict are indexed
+    once per (dataset, year) and reused for repeat searches; any other dict is indexed on every call.
+    """
+    key = get_variables_key(variables_dict)
+    if key is None:
+        return variableIndex(variables_dict)
+    cached = indexes.get(key)
+    if cached is not None and cached.dict is variables_dict:
+        indexes.move_to_end(key)
+        return cached
+    index = variableIndex(variables_dict)
+    indexes[key] = index
+    while len(indexes) > MAX_CACHED_INDEXES:
+        indexes.popitem(last=False)
+    return index
+
+
+class MyTestCase(unittest.TestCase):
+    variables = {
+        0: {'Name': 'B01001_001E', 'Label': 'Estimate!!Total', 'Concept': 'SEX BY AGE'},
+        1: {'Name': 'B01001_002E', 'Label': 'Estimate!!Total!!Male', 'Concept': 'SEX BY AGE'},
+        2: {'Name': 'B01001_003E', 'Label': 'Estimate!!Total!!Male!!Under 5 years', 'Concept': 'SEX BY AGE'},
+        3: {'Name': 'B19013_001E', 'Label': 'Estimate!!Median household income in the past 12 months',
+            'Concept': 'MEDIAN HOUSEHOLD INCOME IN THE PAST 12 MONTHS'},
+    }
+
+    def test_regex_search(self):
+        index = variableIndex(self.variables)
+        self.assertEqual([1, 2], list(index.search('Label', 'male').keys()))
+        self.assertEqual([3], list(index.search('Concept', '^median').keys()))
+        self.assertEqual([0, 1], list(index.search('Label', r'Total(?!!!Male!!)').keys()))
+
+    def test_keyword_search(self):
+        index = variableIndex(self.variables)
+        self.assertEqual([3], list(index.search_keywords('household income').keys()))
+        self.assertEqual({}, index.search_keywords('female'))
+
+    def test_hierarchy(self):
+        index = variableIndex(self.variables)
+        self.assertEqual([0], list(index.get_totals().keys()))
+        self.assertEqual([2], list(index.get_children('Estimate!!Total!!Male').keys()))
+        self.assertEqual(4, index.get_depth(2))
+
+    def test_index_is_reused(self):
+        with mock.patch.dict(variable_dicts, {('acs/acs5', '2022'): dict(self.variables)}):
+            index = get_variable_index(variable_dicts[('acs/acs5', '2022')])
+            self.assertIs(index, get_variable_index(variable_dicts[('acs/acs5', '2022')]))
+            # A refreshed vintage is a new dict under the same key
+            variable_dicts[('acs/acs5', '2022')] = dict(self.variables)
+            self.assertIsNot(index, get_variable_index(variable_dicts[('acs/acs5', '2022')]))
+        self.assertIsNot(get_variable_index(self.variables), get_variable_index(self.variables))
+
+if __name__ == '__main__':
+    unittest.main()